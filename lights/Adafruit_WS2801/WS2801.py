@@ -41,10 +41,14 @@ def color_to_RGB(color):
 class WS2801Pixels(object):
     """WS2801/SPI interface addressable RGB LED lights."""
 
-    def __init__(self, count, clk=None, do=None, spi=None, gpio=None):
+    def __init__(self, count, clk=None, do=None, spi=None, gpio=None, latch=0.0005, buffer=None):
         """Initialize set of WS2801/SPI-like addressable RGB LEDs.  Must
         specify the count of pixels, and either an explicit clk (clokc) and do
         (data output) line for software SPI or a spi instance for hardware SPI.
+        The latch time is how long (in seconds) the clock must stay low after a
+        transfer for the WS2801 to latch the data, 500us per the datasheet.
+        Optionally a writable buffer of count*3 bytes (e.g. in shared memory)
+        can be provided to hold the pixel data.
         """
         self._spi = None
         if spi is not None:
@@ -63,21 +67,109 @@ class WS2801Pixels(object):
         self._spi.set_clock_hz(1000000)
         self._spi.set_mode(0)
         self._spi.set_bit_order(SPI.MSBFIRST)
-        # Setup buffer for pixel RGB data.
+        # Setup buffer for pixel RGB data.  A contiguous bytearray is used so
+        # the whole frame can be updated with slice assignment and handed to
+        # the SPI device without being converted on every show().
         self._count = count
-        self._pixels = [0]*(count*3)
+        if buffer is None:
+            self._pixels = bytearray(count*3)
+        else:
+            self._pixels = memoryview(buffer).cast('B')
+            if len(self._pixels) != count*3:
+                raise ValueError('Pixel buffer must be exactly count*3 bytes!')
+        self._view = memoryview(self._pixels)
+        self._blank = bytes(count*3)
+        # Copy of the last frame written to the hardware along with the range
+        # of pixels [start, stop) which has been changed since then.  show()
+        # skips the write when nothing in that range differs from the copy.
+        self._last = bytearray(count*3)
+        self._shown = False
+        self._dirty_start = 0
+        self._dirty_stop = count
+        # Monotonic time at which the last transfer has been latched and the
+        # next one may start.
+        self._latch = latch
+        self._latched_at = 0.0
+        # Optional function mapping the buffer to the bytes written to the
+        # hardware (e.g. for channel order or gamma), see set_transform().
+        self._transform = None
+        # Prefer spidev's writebytes2, which takes any buffer object directly
+        # (and has no 4096 byte transfer limit), over the list based write().
+        self._write = self._spi.write
+        device = getattr(self._spi, '_device', None)
+        if device is not None and hasattr(device, 'writebytes2'):
+            self._write = device.writebytes2
 
-    def show(self):
+    def show(self, force=False):
         """Push the current pixel values out to the hardware.  Must be called to
-        actually change the pixel colors.
+        actually change the pixel colors.  The write is skipped when the buffer
+        is identical to the last frame pushed, unless force is True.  Returns
+        True if the frame was written.
+        """
+        start = self._dirty_start*3
+        stop = self._dirty_stop*3
+        if not force and self._shown and (start >= stop or self._pixels[start:stop] == self._last[start:stop]):
+            self._dirty_start = self._count
+            self._dirty_stop = 0
+            return False
+        # Only wait out whatever is left of the latch gap after the previous
+        # transfer, usually the time spent rendering the frame has covered it.
+        remaining = self._latched_at - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+        if self._transform is None:
+            self._write(self._pixels)
+        else:
+            self._write(self._transform(self._pixels))
+        self._latched_at = time.monotonic() + self._latch
+        if force or not self._shown:
+            self._last[:] = self._pixels
+        else:
+            self._last[start:stop] = self._view[start:stop]
+        self._shown = True
+        self._dirty_start = self._count
+        self._dirty_stop = 0
+        return True
+
+    def set_transform(self, transform):
+        """Set a function which is given the pixel buffer on every show() and
+        returns the bytes to write to the hardware, or None to write the buffer
+        as is.  The next show() always writes the frame.
         """
-        self._spi.write(self._pixels)
-        time.sleep(0.002)
+        self._transform = transform
+        self._shown = False
 
     def count(self):
         """Return the count of pixels."""
         return self._count
 
+    def buffer(self):
+        """Return a read/write memoryview of the raw pixel buffer.  The buffer
+        holds count()*3 bytes in red, green, blue order per pixel.  As the
+        caller may write to it, the whole buffer is marked as changed.
+        """
+        self._mark(0, self._count)
+        return self._view
+
+    def get_bytes(self):
+        """Return a copy of the pixel buffer as packed red, green, blue bytes."""
+        return bytes(self._pixels)
+
+    def dirty(self):
+        """Return the (start, stop) range of pixels changed since the last
+        show(), or None if nothing has changed.
+        """
+        if self._dirty_start >= self._dirty_stop:
+            return None
+        return (self._dirty_start, self._dirty_stop)
+
+    def _mark(self, start, stop):
+        """Extend the changed range to include pixels start to stop."""
+        if start < self._dirty_start:
+            self._dirty_start = start
+        if stop > self._dirty_stop:
+            self._dirty_stop = stop
+
     def set_pixel(self, n, color):
         """Set the specified pixel n to the provided 24-bit RGB color.  Note you
         MUST call show() after setting pixels to see the LEDs change color!"""
@@ -94,6 +186,7 @@ class WS2801Pixels(object):
         see the LEDs change color!
         """
         assert n >= 0 and n < self._count, 'Pixel n outside the count of pixels!'
+        self._mark(n, n+1)
         self._pixels[n*3]   = r & 0xFF
         self._pixels[n*3+1] = g & 0xFF
         self._pixels[n*3+2] = b & 0xFF
@@ -107,6 +200,7 @@ class WS2801Pixels(object):
         assert s >= 0.0 and s <= 1.0, 'Saturation out of normalized value 0.0-1.0'
         assert v >= 0.0 and v <= 1.0, 'Value out of normalized value 0.0-1.0'
         (r, g, b) = colorsys.hsv_to_rgb(h, s, v)
+        self._mark(n, n+1)
         self._pixels[n*3]   = int(r * 255)
         self._pixels[n*3+1] = int(g * 255)
         self._pixels[n*3+2] = int(b * 255)
@@ -126,16 +220,51 @@ class WS2801Pixels(object):
     def set_pixels(self, color=0):
         """Set all pixels to the provided 24-bit RGB color value.  Note you
         MUST call show() after setting pixels to see the LEDs change!"""
-        for i in range(self._count):
-            self.set_pixel(i, color)
+        self.fill(color >> 16, color >> 8, color)
 
     def set_pixels_rgb(self, r, g, b):
         """Set all pixels to the provided 8-bit red, green, blue component color
         value.  Note you MUST call show() after setting pixels to see the LEDs
         change!
         """
-        for i in range(self._count):
-            self.set_pixel_rgb(i, r, g, b)
+        self.fill(r, g, b)
+
+    def fill(self, r, g, b):
+        """Set all pixels to the provided 8-bit red, green, blue component color
+        value in a single slice assignment.  Note you MUST call show() after
+        setting pixels to see the LEDs change!
+        """
+        self._mark(0, self._count)
+        self._pixels[:] = bytes((r & 0xFF, g & 0xFF, b & 0xFF)) * self._count
+
+    def fill_range(self, start, stop, r, g, b):
+        """Set pixels start (inclusive) to stop (exclusive) to the provided
+        8-bit red, green, blue component color value.  Note you MUST call show()
+        after setting pixels to see the LEDs change!
+        """
+        assert 0 <= start <= stop <= self._count, 'Pixel range outside the count of pixels!'
+        self._mark(start, stop)
+        self._view[start*3:stop*3] = bytes((r & 0xFF, g & 0xFF, b & 0xFF)) * (stop - start)
+
+    def set_bytes(self, data, start=0):
+        """Copy packed red, green, blue bytes into the buffer beginning at
+        pixel start.  The length of data must be a multiple of 3 and fit within
+        the count of pixels.  Note you MUST call show() after setting pixels to
+        see the LEDs change!
+        """
+        length = len(data)
+        assert length % 3 == 0, 'Pixel data must be a multiple of 3 bytes!'
+        assert start >= 0 and start*3 + length <= len(self._pixels), 'Pixel data outside the count of pixels!'
+        self._mark(start, start + length // 3)
+        self._view[start*3:start*3+length] = data
+
+    def set_buffer(self, buffer, start=0):
+        """Copy pixel data from any object supporting the buffer protocol
+        (e.g. a memoryview or a C-contiguous uint8 array of shape (N, 3)) into
+        the buffer beginning at pixel start.  Note you MUST call show() after
+        setting pixels to see the LEDs change!
+        """
+        self.set_bytes(memoryview(buffer).cast('B'), start)
 
     def set_pixels_hsv(self, h, s, v):
         """Set all pixels to the provided float hue, sataturation
@@ -149,7 +278,8 @@ class WS2801Pixels(object):
         """Clear all the pixels to black/off.  Note you MUST call show() after
         clearing pixels to see the LEDs change!
         """
-        self.set_pixels(0)
+        self._mark(0, self._count)
+        self._pixels[:] = self._blank
 #
 # def colorwipe(pixels, c, delay):
 #     for i in range(len(pixels)):
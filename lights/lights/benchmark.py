@@ -0,0 +1,164 @@
+# Headless benchmark of the light patterns
+# Copyright Notice
+#
+# Runs every pattern (and all_random) against an SPI device which discards
+# the data, with all sleeps disabled, for a range of strip sizes.  Reports
+# frames/sec, the mean and p99 time to render a frame, the time spent in
+# show(), bytes pushed per frame and (optionally) memory allocated per frame.
+#
+# Usage (from this directory):
+#   python benchmark.py --sizes 160,1000,5000 --json results.json
+#   python benchmark.py --compare results.json
+
+import argparse
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import Adafruit_WS2801
+
+import config
+import frames
+import lights
+from lights import LightsController
+from virtual import NullSpi
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[int(fraction * (len(values) - 1))]
+
+def setup_strip(size):
+    """Point the controller and the patterns at a strip of size pixels on a NullSpi"""
+    spi = NullSpi()
+    config.pixel_count = size
+    lights.pattern_lights = range(0, size)
+    LightsController.pixels = Adafruit_WS2801.WS2801Pixels(size, spi=spi, latch=0)
+    LightsController.pixels.set_transform(LightsController.create_transform())
+    LightsController.tables_key = None
+    LightsController.build_tables()
+    return spi
+
+def run_pattern(pattern, size, max_frames, allocations=False, seed=0):
+    """Run one round of the pattern and returns its results"""
+    random.seed(seed)
+    config.playlist_seed = seed
+    config.color = {'r': 255, 'g': 128, 'b': 0}
+    spi = setup_strip(size)
+    steps = lights.registry[pattern](0, 0, 1)
+    render = []
+    show = []
+    allocated = []
+    completed = False
+    track = allocations and hasattr(tracemalloc, 'reset_peak')
+    if track:
+        tracemalloc.start()
+    clock = time.perf_counter
+    started = clock()
+    while len(render) < max_frames:
+        if track:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        t = clock()
+        try:
+            next(steps)
+        except StopIteration:
+            completed = True
+            break
+        t2 = clock()
+        LightsController.pixels.show()
+        render.append(t2 - t)
+        show.append(clock() - t2)
+        if track:
+            allocated.append(tracemalloc.get_traced_memory()[1] - base)
+    elapsed = clock() - started
+    if track:
+        tracemalloc.stop()
+    count = len(render) or 1
+    return {
+        'pattern': pattern,
+        'pixels': size,
+        'frames': len(render),
+        # the round finished within max_frames, so frames is the length of a round
+        'round_completed': completed,
+        'round_seconds': sum(render) + sum(show) if completed else None,
+        'fps': len(render) / elapsed if elapsed > 0 else 0.0,
+        'render_mean_ms': sum(render) / count * 1000,
+        'render_p99_ms': percentile(render, 0.99) * 1000,
+        'show_mean_ms': sum(show) / count * 1000,
+        'bytes_per_frame': spi.bytes / count,
+        'writes_per_frame': spi.writes / count,
+        'alloc_bytes_per_frame': sum(allocated) / count if track else None,
+    }
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+def print_results(results):
+    print('%-18s %6s %7s %9s %9s %9s %9s %10s %10s' % (
+        'pattern', 'pixels', 'frames', 'fps', 'mean ms', 'p99 ms', 'show ms', 'bytes/fr', 'alloc/fr'))
+    for r in results:
+        alloc = '-' if r['alloc_bytes_per_frame'] is None else '%.0f' % r['alloc_bytes_per_frame']
+        print('%-18s %6d %7d %9.1f %9.3f %9.3f %9.3f %10.1f %10s' % (
+            r['pattern'], r['pixels'], r['frames'], r['fps'], r['render_mean_ms'],
+            r['render_p99_ms'], r['show_mean_ms'], r['bytes_per_frame'], alloc))
+
+def compare(results, path):
+    """Print the change in fps against a previous results file"""
+    with open(path) as f:
+        previous = json.load(f)
+    old = dict(((r['pattern'], r['pixels']), r) for r in previous['results'])
+    print('\nCompared to %s (%s):' % (path, previous.get('revision')))
+    for r in results:
+        o = old.get((r['pattern'], r['pixels']))
+        if o is None or not o['fps']:
+            continue
+        print('%-18s %6d %+8.1f%% fps' % (r['pattern'], r['pixels'], (r['fps'] / o['fps'] - 1) * 100))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the light patterns')
+    parser.add_argument('--sizes', default='160,1000,5000', help='comma separated strip sizes')
+    parser.add_argument('--patterns', default=None, help='comma separated patterns (default all)')
+    parser.add_argument('--frames', type=int, default=2000, help='maximum frames per pattern')
+    parser.add_argument('--allocations', action='store_true',
+                        help='measure memory allocated per frame (Python 3.9+), '
+                             'this slows everything down so timings are not comparable')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for the random patterns')
+    parser.add_argument('--json', default=None, help='write the results to this file')
+    parser.add_argument('--compare', default=None, help='compare with a previous results file')
+    args = parser.parse_args()
+
+    lights.load_pattern_specs()
+    if args.patterns:
+        names = args.patterns.split(',')
+    else:
+        names = lights.patterns + ['all_random']
+    results = []
+    for size in [int(s) for s in args.sizes.split(',')]:
+        for pattern in names:
+            results.append(run_pattern(pattern, size, args.frames, args.allocations, args.seed))
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'revision': git_revision(),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'numpy': frames.enabled,
+                'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'results': results,
+            }, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,48 @@
+# Frame cache for periodic patterns
+# Copyright Notice
+#
+# Deterministic patterns produce the same frames every round for a given set
+# of parameters, so one full round is recorded as packed RGB frames and then
+# replayed instead of being rendered again.
+
+from collections import OrderedDict
+
+class FrameCache(object):
+    """Cache of recorded pattern rounds bounded by a memory budget (in bytes)
+       The least recently used round is evicted first when the budget is exceeded.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.size = 0
+        self.cycles = OrderedDict()
+
+    def get(self, key):
+        """Returns the list of (frame, wait) for the key or None if not cached"""
+        cycle = self.cycles.get(key)
+        if cycle is not None:
+            self.cycles.move_to_end(key)
+        return cycle
+
+    def put(self, key, cycle):
+        """Store the list of (frame, wait) for the key
+           Returns False if the cycle is larger than the whole budget
+        """
+        size = sum(len(frame) for frame, wait in cycle)
+        if size > self.budget:
+            return False
+        self.discard(key)
+        while self.cycles and self.size + size > self.budget:
+            self.discard(next(iter(self.cycles)))
+        self.cycles[key] = cycle
+        self.size += size
+        return True
+
+    def discard(self, key):
+        cycle = self.cycles.pop(key, None)
+        if cycle is not None:
+            self.size -= sum(len(frame) for frame, wait in cycle)
+
+    def clear(self):
+        self.cycles.clear()
+        self.size = 0
@@ -0,0 +1,107 @@
+# Multi-layer pattern compositor
+# Copyright Notice
+#
+# Several patterns can run at once as layers, e.g. rainbow_cycle underneath
+# with chase_up on top.  Each layer's pattern draws into its own canvas and
+# keeps its own timing, all of them are stepped from one loop and the canvases
+# are combined into the pixel buffer before the frame is pushed.
+#
+# The bottom layer is copied as is, each layer above is blended onto the
+# result with its mode:
+#   replace  the lit (not black) pixels of the layer replace those below
+#   add      the channels are added (saturating at 255)
+#   max      the brightest value of each channel is kept
+#   alpha    the lit pixels of the layer are blended over those below by
+#            the layer's opacity
+
+import frames
+
+MODES = ('replace', 'add', 'max', 'alpha')
+
+class Layer(object):
+    """A pattern drawing into its own canvas
+       steps() must return the pattern's generator, it is called while the
+       canvas is selected as the pixels to draw into
+    """
+
+    def __init__(self, canvas, steps, mode='replace', opacity=1.0):
+        if mode not in MODES:
+            raise ValueError('Unknown blend mode: %s' % mode)
+        self.canvas = canvas
+        self.steps = steps
+        self.mode = mode
+        self.opacity = min(max(opacity, 0.0), 1.0)
+        self.generator = None
+        self.due = 0.0
+        self.done = False
+
+
+def blend(frame, layer, mode, opacity=1.0):
+    """Blend the packed RGB bytes of layer onto the bytearray frame in place"""
+    if mode == 'add':
+        frame[:] = bytes(min(a + b, 255) for a, b in zip(frame, layer))
+    elif mode == 'max':
+        frame[:] = bytes(max(a, b) for a, b in zip(frame, layer))
+    else:
+        weight = 256 if mode == 'replace' else int(round(opacity * 256))
+        for i in range(0, len(frame), 3):
+            top = layer[i:i + 3]
+            if any(top):
+                frame[i:i + 3] = bytes((a * (256 - weight) + b * weight + 128) >> 8
+                                       for a, b in zip(frame[i:i + 3], top))
+
+def combine(pixels, layers):
+    """Combine the canvases of the layers into pixels"""
+    if frames.enabled:
+        frame = frames.as_frame(pixels.buffer())
+        frame[:] = frames.as_frame(layers[0].canvas.get_bytes())
+        for layer in layers[1:]:
+            frames.blend(frame, layer.canvas.get_bytes(), layer.mode, layer.opacity)
+    else:
+        frame = bytearray(layers[0].canvas.get_bytes())
+        for layer in layers[1:]:
+            blend(frame, layer.canvas.get_bytes(), layer.mode, layer.opacity)
+        pixels.set_bytes(frame)
+
+def composite(pixels, layers, select):
+    """Generator which runs the layers and combines them into pixels, for running
+       with the frame scheduler.  select(canvas) is called to make the patterns
+       draw into a canvas and select(pixels) to go back.
+       Finishes once all the layers have finished.
+    """
+    # the layers' deadlines are absolute times on the composite's own timeline,
+    # which the frame scheduler follows with its deadlines, so a frame which is
+    # pushed late doesn't push back the layers (the scheduler resyncs when it
+    # falls too far behind)
+    try:
+        for layer in layers:
+            select(layer.canvas)
+            layer.generator = layer.steps()
+            layer.due = 0.0
+        select(pixels)
+        now = 0.0
+        while True:
+            for layer in layers:
+                if layer.done or layer.due > now:
+                    continue
+                select(layer.canvas)
+                try:
+                    layer.due += max(0.0, next(layer.generator) or 0.0)
+                except StopIteration:
+                    # the layer keeps showing its last frame
+                    layer.done = True
+                finally:
+                    select(pixels)
+            combine(pixels, layers)
+            running = [layer.due for layer in layers if not layer.done]
+            if not running:
+                yield 0.0
+                break
+            due = max(now, min(running))
+            yield due - now
+            now = due
+    finally:
+        select(pixels)
+        for layer in layers:
+            if layer.generator is not None:
+                layer.generator.close()
@@ -13,6 +13,9 @@ path = os.path.abspath(os.path.join(os.path.dirname(__file__), "../"))
 # paths
 path_templates = os.path.join(path, 'templates')
 path_web = os.path.join(path, 'web')
+path_sequences = os.path.join(path, 'var/sequences')
+path_state = os.path.join(path, 'var/state.json')
+path_patterns = os.path.join(path, '../patterns.json')
 
 # load config file
 config = configparser.ConfigParser()
@@ -24,11 +27,122 @@ if config.has_section('general') and config.has_option('general', 'pixel_count')
     pixel_count = config.getint('general', 'pixel_count')
 
 # set to True to designate that the LED lights are RBG (not RGB)
-# this will swap the blue and green values when setting colors
+# this will swap the blue and green values when the frames are written
 is_rbg = True
 if config.has_section('general') and config.has_option('general', 'is_rbg'):
     is_rbg = config.getboolean('general', 'is_rbg')
 
+# output backend for the lights: spi (the LED strip), virtual (records the
+# frames in memory, for running without a Raspberry Pi) or auto (spi if the
+# GPIO interface is available, otherwise virtual)
+output_backend = 'auto'
+if config.has_section('output') and config.has_option('output', 'backend'):
+    output_backend = config.get('output', 'backend')
+
+# gamma correction applied when the frames are written, either one value or
+# comma separated values for red, green and blue (1.0 is no correction)
+gamma = 1.0
+if config.has_section('output') and config.has_option('output', 'gamma'):
+    gamma = tuple(float(value) for value in config.get('output', 'gamma').split(','))
+    if len(gamma) == 1:
+        gamma = gamma[0]
+
+# global brightness of the lights (0 to 255)
+brightness = 255
+if config.has_section('output') and config.has_option('output', 'brightness'):
+    brightness = config.getint('output', 'brightness')
+
+# number of recent frames kept by the virtual backend
+virtual_frames = 1000
+if config.has_section('output') and config.has_option('output', 'virtual_frames'):
+    virtual_frames = config.getint('output', 'virtual_frames')
+
+# segments of the strip which are on their own SPI port and device, read from
+# the [segment...] sections, each covers pixels start (inclusive) to end
+# (exclusive).  By default all pixels are on SPI port 0, device 0.
+segments = []
+for section in sorted(config.sections()):
+    if section.startswith('segment'):
+        segments.append({
+            'start': config.getint(section, 'start', fallback=0),
+            'end': config.getint(section, 'end', fallback=pixel_count),
+            'port': config.getint(section, 'port', fallback=0),
+            'device': config.getint(section, 'device', fallback=0),
+            'reversed': config.getboolean(section, 'reversed', fallback=False),
+        })
+
+# seconds to crossfade from the current frame when a pattern is started,
+# 0 to switch straight away
+crossfade = 0.5
+if config.has_section('fade') and config.has_option('fade', 'crossfade'):
+    crossfade = config.getfloat('fade', 'crossfade')
+
+# easing curve of the crossfade: linear, ease_in, ease_out or ease_in_out
+fade_easing = 'ease_in_out'
+if config.has_section('fade') and config.has_option('fade', 'easing'):
+    fade_easing = config.get('fade', 'easing')
+
+# seed of the all_random playlist so that it plays the same patterns (with the
+# same parameters) every time, None for a different playlist every time
+playlist_seed = None
+if config.has_section('playlist') and config.has_option('playlist', 'seed'):
+    playlist_seed = config.getint('playlist', 'seed')
+
+# set to True to collect metrics for the render and SPI paths (served at /metrics)
+metrics_enabled = False
+if config.has_section('metrics') and config.has_option('metrics', 'enabled'):
+    metrics_enabled = config.getboolean('metrics', 'enabled')
+
+# set to True to receive frames streamed over UDP (see realtime.py)
+realtime_enabled = False
+if config.has_section('realtime') and config.has_option('realtime', 'enabled'):
+    realtime_enabled = config.getboolean('realtime', 'enabled')
+
+# address and port the realtime input listens on
+realtime_address = ''
+if config.has_section('realtime') and config.has_option('realtime', 'address'):
+    realtime_address = config.get('realtime', 'address')
+realtime_port = 5568
+if config.has_section('realtime') and config.has_option('realtime', 'port'):
+    realtime_port = config.getint('realtime', 'port')
+
+# format of the realtime packets: raw or e131
+realtime_protocol = 'raw'
+if config.has_section('realtime') and config.has_option('realtime', 'protocol'):
+    realtime_protocol = config.get('realtime', 'protocol')
+
+# the E1.31 universe mapped to the first pixel
+realtime_universe = 1
+if config.has_section('realtime') and config.has_option('realtime', 'universe'):
+    realtime_universe = config.getint('realtime', 'universe')
+
+# seconds without a realtime packet before the previous pattern is resumed
+realtime_timeout = 2.5
+if config.has_section('realtime') and config.has_option('realtime', 'timeout'):
+    realtime_timeout = config.getfloat('realtime', 'timeout')
+
+# memory budget (in MB) for caching the frames of periodic patterns, 0 to disable
+cache_budget = 8
+if config.has_section('cache') and config.has_option('cache', 'memory_budget'):
+    cache_budget = config.getfloat('cache', 'memory_budget')
+
+# number of processes rendering the frames of the render pool's patterns ahead
+# (see pool.py), 0 to render all patterns in the render worker
+render_workers = 0
+if config.has_section('render') and config.has_option('render', 'workers'):
+    render_workers = config.getint('render', 'workers')
+
+# patterns rendered by the render pool, only patterns with a frame program
+# (see frame_program in lights.py) can be rendered by it
+render_patterns = ['appear_from_back', 'random_on_off']
+if config.has_section('render') and config.has_option('render', 'patterns'):
+    render_patterns = [p.strip() for p in config.get('render', 'patterns').split(',') if p.strip()]
+
+# frames buffered by the render pool
+render_buffer = 8
+if config.has_section('render') and config.has_option('render', 'buffer'):
+    render_buffer = config.getint('render', 'buffer')
+
 # starting color
 color = {
     'r': 255,
@@ -41,12 +155,15 @@ initialized = False
 
 # logging
 log_file = os.path.join(path, 'var/log/lights.log')
-if not os.path.isfile(log_file):
-    if not os.path.exists(os.path.dirname(log_file)):
-        os.makedirs(os.path.dirname(log_file))
-    open(log_file, 'a').close()
 log_level = logging.DEBUG
 if config.has_section('logging') and config.has_option('logging', 'level'):
     log_level = config.get('logging', 'level')
-logging.basicConfig(filename=log_file, level=log_level, 
-                    format='%(asctime)s - %(levelname)-7s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+
+def setup_logging():
+    """Log to the log file, this is done by the web app at startup rather than
+       when the config is imported
+    """
+    if not os.path.exists(os.path.dirname(log_file)):
+        os.makedirs(os.path.dirname(log_file))
+    logging.basicConfig(filename=log_file, level=log_level, 
+                        format='%(asctime)s - %(levelname)-7s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
@@ -0,0 +1,106 @@
+# Fades and crossfades for the light patterns
+# Copyright Notice
+#
+# A fade blends a start frame into a target frame over a duration.  Each step
+# is one bulk blend of the whole buffer at the eased position given by the time
+# elapsed, so the number of steps follows the frame rate which can actually be
+# reached (late frames are skipped by the frame scheduler) instead of being
+# fixed.  A fade still takes a minimum number of steps, spread over its
+# duration, so a very short fade (e.g. with no delay) isn't a single jump.
+# The functions are generators which yield the wait after each step,
+# like the patterns.
+
+import math
+import time
+
+import frames
+
+# shortest wait between the steps of a fade (in seconds)
+STEP = 1.0 / 60
+
+# the least number of steps of a fade
+MIN_STEPS = 32
+
+def linear(t):
+    return t
+
+def ease_in(t):
+    return t * t
+
+def ease_out(t):
+    return t * (2 - t)
+
+def ease_in_out(t):
+    return (1 - math.cos(t * math.pi)) / 2
+
+# easing curves by name, each maps 0..1 onto 0..1
+easings = {
+    'linear': linear,
+    'ease_in': ease_in,
+    'ease_out': ease_out,
+    'ease_in_out': ease_in_out,
+    }
+
+def blend(pixels, start, target, amount):
+    """Set pixels to start blended towards target by amount (0 to 1), the frames
+       are packed RGB bytes for all pixels
+    """
+    if frames.enabled:
+        frames.lerp(start, target, amount, pixels.buffer())
+    else:
+        weight = int(round(amount * 256))
+        pixels.set_bytes(bytes((a * (256 - weight) + b * weight + 128) >> 8 for a, b in zip(start, target)))
+
+def fade(pixels, target, duration, easing='linear', clock=time.monotonic):
+    """Fade from the current frame to the target frame over duration seconds,
+       in at least MIN_STEPS steps
+    """
+    ease = easings[easing]
+    start = pixels.get_bytes()
+    began = clock()
+    step = 0
+    while True:
+        step += 1
+        elapsed = clock() - began
+        position = min(elapsed / duration if duration > 0 else 1.0, step / MIN_STEPS)
+        if position >= 1:
+            break
+        blend(pixels, start, target, ease(position))
+        remaining = max(0.0, duration - elapsed)
+        yield min(STEP, remaining / max(1, MIN_STEPS - step))
+    pixels.set_bytes(target)
+    yield 0
+
+def crossfade(pixels, previous, steps, duration, easing='linear', clock=time.monotonic):
+    """Wraps a pattern's steps, blending from the previous frame into the
+       pattern's frames over the first duration seconds of the pattern.
+       The pattern's own frame is put back before each of its steps, so patterns
+       which only change some of the pixels are not affected by the blend.
+    """
+    ease = easings[easing]
+    began = None
+    for wait in steps:
+        now = clock()
+        if began is None:
+            began = now
+        if now - began >= duration:
+            yield wait
+            break
+        frame = pixels.get_bytes()
+        # the pattern's wait may be long (e.g. a pause), so the blend is
+        # stepped along within it
+        end = now + wait
+        while True:
+            elapsed = now - began
+            if elapsed >= duration:
+                pixels.set_bytes(frame)
+                yield end - now
+                break
+            blend(pixels, previous, frame, ease(elapsed / duration))
+            yield min(STEP, max(0.0, end - now))
+            now = clock()
+            if now >= end:
+                break
+        pixels.set_bytes(frame)
+    for wait in steps:
+        yield wait
@@ -0,0 +1,87 @@
+# Vectorized frame rendering for the light patterns
+# Copyright Notice
+#
+# The functions compute whole frames as (N, 3) uint8 arrays which can be
+# written into the pixel buffer in one step with WS2801Pixels.set_buffer().
+# NumPy is optional; when it is not installed enabled is False and the
+# patterns fall back to setting the pixels one at a time.
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# flag designating that the vectorized frame engine can be used
+enabled = numpy is not None
+
+def wheel(positions):
+    """Vectorized version of LightsController.wheel
+       Returns an (N, 3) array of the interpolated hues for each wheel position
+    """
+    pos = numpy.asarray(positions, dtype=numpy.int32) % 256
+    frame = numpy.zeros((pos.size, 3), dtype=numpy.uint8)
+    low = pos < 85
+    mid = (pos >= 85) & (pos < 170)
+    high = pos >= 170
+    p = pos[low] * 3
+    frame[low, 0] = p
+    frame[low, 1] = 255 - p
+    p = (pos[mid] - 85) * 3
+    frame[mid, 0] = 255 - p
+    frame[mid, 2] = p
+    p = (pos[high] - 170) * 3
+    frame[high, 1] = p
+    frame[high, 2] = 255 - p
+    return frame
+
+def wheel_table():
+    """The 256 entry color wheel as a (256, 3) RGB array"""
+    return numpy.ascontiguousarray(wheel(numpy.arange(256)))
+
+def phase_table(count):
+    """The wheel offset of each pixel (i * 256 // count) as a uint8 array so that
+       adding a step wraps around the wheel without a modulo
+    """
+    return (numpy.arange(count) * 256 // count).astype(numpy.uint8)
+
+def gather(table, index, buffer):
+    """Write table[index] for each pixel directly into the pixel buffer"""
+    numpy.take(table, index, axis=0, out=numpy.frombuffer(buffer, dtype=numpy.uint8).reshape(-1, 3))
+
+def lerp(start, target, amount, buffer):
+    """Write start blended towards target by amount (0 to 1) into the pixel
+       buffer, using 8 bit fixed point weights
+    """
+    weight = int(round(amount * 256))
+    a = numpy.frombuffer(start, dtype=numpy.uint8).astype(numpy.uint16)
+    b = numpy.frombuffer(target, dtype=numpy.uint8).astype(numpy.uint16)
+    a *= 256 - weight
+    b *= weight
+    a += b
+    a += 128
+    a >>= 8
+    numpy.frombuffer(buffer, dtype=numpy.uint8)[:] = a
+
+def as_frame(buffer):
+    """The packed RGB bytes of buffer as an (N, 3) array (writable if buffer is)"""
+    return numpy.frombuffer(buffer, dtype=numpy.uint8).reshape(-1, 3)
+
+def blend(frame, layer, mode, opacity=1.0):
+    """Blend the packed RGB bytes of layer onto the (N, 3) array frame in place
+       with one of the compositor's blend modes (see compositor.py)
+    """
+    top = as_frame(layer)
+    if mode == 'add':
+        numpy.minimum(frame.astype(numpy.uint16) + top, 255, out=frame, casting='unsafe')
+    elif mode == 'max':
+        numpy.maximum(frame, top, out=frame)
+    else:
+        lit = top.any(axis=1)
+        if mode == 'replace':
+            frame[lit] = top[lit]
+        else:
+            weight = int(round(opacity * 256))
+            below = frame[lit].astype(numpy.uint16) * (256 - weight)
+            below += top[lit].astype(numpy.uint16) * weight
+            below += 128
+            frame[lit] = below >> 8
@@ -2,20 +2,33 @@
 # Phil Hansen, 22 October 2016
 # Copyright Notice
 
+import bisect
 import logging
 import os
 import random
-import signal
 import time
-import RPi.GPIO as GPIO
 
 import Adafruit_WS2801
 import Adafruit_GPIO.SPI as SPI
 
-from multiprocessing import Process
+import compositor
 import config
+import fade
+import frames
+import playlist
+import sequence
+import specs
+from cache import FrameCache
+from pool import RenderPool
+from segments import Segment, SegmentedOutput
+from shared import SharedBlock
+from state import StateFile
+from transform import OutputTransform
+from virtual import NullSpi, VirtualStrip
+from worker import RenderWorker
 
-# list of the known patterns
+# list of the known patterns, the patterns from the pattern specs are added
+# when they are loaded (see load_pattern_specs)
 patterns = [
     'chase_up',
     'chase_down',
@@ -32,79 +45,272 @@ patterns = [
     'rainbow_cycle',
     ]
 
+# patterns which produce the same frames every round for a given color, pixel
+# count and channel order, these are rendered once and replayed from the cache
+cached_patterns = [
+    'alternating',
+    'rainbow_colors',
+    'rainbow_cycle',
+    ]
+
+# the pattern functions by name, see register_pattern
+registry = {}
+
+# the frame programs by pattern name, for rendering in the render pool (see
+# frame_program)
+frame_programs = {}
+
 # list of the lights to use in patterns
 pattern_lights = range(0, config.pixel_count)
 
 SPI_PORT   = 0
 SPI_DEVICE = 0
 
+def load_gpio():
+    """Returns the Raspberry Pi GPIO interface or None if it is not available
+       This is only imported when the SPI output is needed
+    """
+    try:
+        import RPi.GPIO as GPIO
+    except (ImportError, RuntimeError):
+        # a RuntimeError occurs when the GPIO interface could not be loaded
+        # (e.g. if not running on a Raspberry Pi), the patterns can still be
+        # run against a virtual strip (see virtual.py)
+        return None
+    return GPIO
+
 class LightsController(object):
     """Contains functions for controlling the lights"""
 
-    # the process for running pattern functions
-    process = None
+    # the render worker process which runs the pattern functions
+    worker = None
 
     # the Adafruit WS2801 pixels object
     pixels = None
+
+    # the SPI device (or virtual strip) the pixels are written to
+    output = None
+
+    # the memory shared with the render worker (framebuffer and state)
+    shared = None
+
+    # the last color, brightness and pattern, resumed at setup
+    state = StateFile(config.path_state)
+
+    # recorded rounds of the cached patterns
+    frame_cache = FrameCache(int(config.cache_budget * 1024 * 1024))
+
+    # lookup tables for the rainbow patterns (see build_tables)
+    tables_key = None
+    wheel_table = None
+    phase_table = None
     
     @staticmethod
     def setup():
-        """Setup the interfaces"""
-        LightsController.pixels = Adafruit_WS2801.WS2801Pixels(config.pixel_count, spi=SPI.SpiDev(SPI_PORT, SPI_DEVICE), gpio=GPIO)
+        """Setup the interfaces and resume the saved color, brightness and pattern"""
+        saved = LightsController.state.load()
+        if 'color' in saved:
+            color = saved['color']
+            if isinstance(color, dict) and all(is_level(color.get(key)) for key in 'rgb'):
+                config.color = {'r': color['r'], 'g': color['g'], 'b': color['b']}
+            else:
+                logging.warning('Ignoring the saved color %s', color)
+        if 'brightness' in saved:
+            if is_level(saved['brightness']):
+                config.brightness = saved['brightness']
+            else:
+                logging.warning('Ignoring the saved brightness %s', saved['brightness'])
+        LightsController.output = LightsController.create_output()
+        LightsController.shared = SharedBlock(config.pixel_count)
+        LightsController.shared.set_color(config.color)
+        LightsController.pixels = Adafruit_WS2801.WS2801Pixels(config.pixel_count, spi=LightsController.output,
+                                                               buffer=LightsController.shared.framebuffer)
+        LightsController.pixels.set_transform(LightsController.create_transform())
+        LightsController.build_tables()
+        load_pattern_specs()
         LightsController.pixels.clear()
         LightsController.pixels.show()
+        pool = RenderPool(config.render_workers, config.render_buffer, config.render_patterns, frame_programs,
+                          lambda: Adafruit_WS2801.WS2801Pixels(config.pixel_count, spi=NullSpi(), latch=0),
+                          LightsController.shared)
+        LightsController.worker = RenderWorker(LightsController.pixels, pattern_steps, LightsController.shared, pool,
+                                               LightsController.pattern_finished)
+        LightsController.worker.start()
+        pattern = saved.get('pattern')
+        if pattern:
+            try:
+                logging.info('Resuming pattern %s', pattern['pattern'])
+                LightsController.start_pattern(**pattern)
+            except (KeyError, TypeError, ValueError) as e:
+                logging.warning('Could not resume the saved pattern %s: %s', pattern, e)
+                LightsController.state.update(pattern=None)
+                pattern = None
+        if not pattern:
+            # the cleared lights are the resumed state, otherwise the time of the
+            # pattern's first frame is recorded by the render worker
+            LightsController.shared.state.first_frame_at = time.monotonic()
         
     @staticmethod
-    def off(lights=None, stop_existing=True):
+    def create_output():
+        """Create the output device for the configured backend"""
+        backend = config.output_backend
+        if backend == 'auto':
+            backend = 'virtual' if load_gpio() is None else 'spi'
+        if backend == 'virtual':
+            logging.info('Using the virtual strip output')
+            return VirtualStrip(config.virtual_frames)
+        if backend != 'spi':
+            raise ValueError('Unknown output backend: %s' % backend)
+        if load_gpio() is None:
+            raise RuntimeError('The GPIO interface is not available')
+        if not config.segments:
+            return SPI.SpiDev(SPI_PORT, SPI_DEVICE)
+        segments = []
+        for segment in config.segments:
+            if segment['end'] > config.pixel_count:
+                raise ValueError('Segment %d to %d is beyond the pixel count' % (segment['start'], segment['end']))
+            logging.info('Segment %d to %d on SPI %d.%d', segment['start'], segment['end'], segment['port'], segment['device'])
+            segments.append(Segment(segment['start'], segment['end'], SPI.SpiDev(segment['port'], segment['device']),
+                                    segment['reversed']))
+        return SegmentedOutput(segments)
+        
+    @staticmethod
+    def create_transform():
+        """Create the output transform for the strip's channel order, gamma and
+           the current brightness
+        """
+        order = 'RBG' if config.is_rbg else 'RGB'
+        return OutputTransform(order, config.gamma, config.brightness)
+
+    @staticmethod
+    def set_brightness(brightness):
+        """Change the global brightness (0 to 255) of the lights"""
+        config.brightness = min(max(int(brightness), 0), 255)
+        LightsController.worker.set_transform(LightsController.create_transform())
+        LightsController.state.update(brightness=config.brightness)
+
+    @staticmethod
+    def off(lights=None, stop_existing=True, show=True):
         """Turn off all lights in the given list
            Default all
            Set stop_existing to False to skip stopping the existing process
+           Set show to False to only change the pixel buffer, for use by the
+           patterns inside the render worker
         """
-        if stop_existing:
-            LightsController.stop_existing_process()
         if lights is None:
-            LightsController.pixels.clear()
+            ops = [('fill', 0, config.pixel_count, 0, 0, 0)]
         else:
-            for i in lights:
-                LightsController.pixels.set_pixel_rgb(i, 0, 0, 0)
-        LightsController.pixels.show()
+            ops = [('pixels', [(i, 0, 0, 0) for i in lights])]
+        LightsController.draw(ops, stop_existing, show)
     
     @staticmethod
-    def on(lights=None, stop_existing=True):
+    def on(lights=None, stop_existing=True, show=True):
         """Turn on all lights in the given list
            Default all
            Set stop_existing to False to skip stopping the existing process
+           Set show to False to only change the pixel buffer, for use by the
+           patterns inside the render worker
         """
-        if stop_existing:
-            LightsController.stop_existing_process()
         if lights is None:
-            LightsController.set_color()
+            LightsController.set_color(stop_existing=stop_existing, show=show)
         else:
-            for i in lights:
-                if config.is_rbg:
-                    LightsController.pixels.set_pixel_rgb(i, config.color['r'], config.color['b'], config.color['g'])
-                else:
-                    LightsController.pixels.set_pixel_rgb(i, config.color['r'], config.color['g'], config.color['b'])
-            LightsController.pixels.show()
+            r, g, b = LightsController.rgb()
+            LightsController.draw([('pixels', [(i, r, g, b) for i in lights])], stop_existing, show)
     
     @staticmethod
-    def set_color(light=None, show=True):
+    def set_color(light=None, stop_existing=False, show=True):
         """Set a specific led or all leds to the current color
-           Set show to False to skip calling pixels.show()
+           Set show to False to only change the pixel buffer
         """
-        if config.is_rbg:
-            if light is None:
-                LightsController.pixels.set_pixels_rgb(config.color['r'], config.color['b'], config.color['g'])
-            else:
-                LightsController.pixels.set_pixel_rgb(light, config.color['r'], config.color['b'], config.color['g'])
+        r, g, b = LightsController.rgb()
+        if light is None:
+            ops = [('fill', 0, config.pixel_count, r, g, b)]
         else:
-            if light is None:
-                LightsController.pixels.set_pixels_rgb(config.color['r'], config.color['g'], config.color['b'])
-            else:
-                LightsController.pixels.set_pixel_rgb(light, config.color['r'], config.color['g'], config.color['b'])
+            ops = [('pixels', [(light, r, g, b)])]
+        LightsController.draw(ops, stop_existing, show)
+
+    @staticmethod
+    def rgb(color=None):
+        """Returns the (r, g, b) values of the color (default the current color)"""
+        if color is None:
+            color = config.color
+        return color['r'], color['g'], color['b']
+
+    @staticmethod
+    def draw(ops, stop_existing=True, show=True):
+        """Apply a list of drawing operations (see RenderWorker.apply) to the lights
+           Normally they are handed to the render worker, the only writer to the
+           lights, which applies them at the next frame boundary and pushes the
+           result once.  If stop_existing is False they are skipped while a
+           pattern is running.
+           Set show to False to apply them straight to the pixel buffer instead,
+           this is how the patterns draw from inside the render worker.
+        """
         if show:
-            LightsController.pixels.show()
+            LightsController.worker.draw(ops, stop_existing)
+            if stop_existing:
+                LightsController.state.update(pattern=None)
+        else:
+            RenderWorker.apply(LightsController.pixels, ops)
+
+    @staticmethod
+    def update_color(color):
+        """Change the current color
+           A running pattern picks up the new color from its next frame,
+           otherwise all leds are set to the new color
+        """
+        config.color = color
+        LightsController.worker.set_color(color)
+        LightsController.set_color()
+        LightsController.state.update(color=color)
+
+    @staticmethod
+    def get_state():
+        """Returns the current color, brightness, running pattern and frame count"""
+        state = LightsController.shared.get_state()
+        state['brightness'] = config.brightness
+        return state
+
+    @staticmethod
+    def get_frame():
+        """Returns the frame currently on the lights as RGB bytes"""
+        return LightsController.shared.get_frame()
+
+    @staticmethod
+    def set_color_range(start, stop, show=True):
+        """Set the leds from start (inclusive) to stop (exclusive) to the current color
+           Set show to False to only change the pixel buffer
+        """
+        r, g, b = LightsController.rgb()
+        LightsController.draw([('fill', start, stop, r, g, b)], False, show)
     
+    @staticmethod
+    def show_range(start, stop):
+        """Show the current color on the leds from start (inclusive) to stop (exclusive)
+           and turn the others off, with a single push.
+           Calls which queue up while the render worker is busy are coalesced by
+           the worker (see RenderWorker.run_draw), only the result is pushed.
+        """
+        count = config.pixel_count
+        start = min(max(start, 0), count)
+        stop = min(max(stop, start), count)
+        r, g, b = LightsController.rgb()
+        LightsController.draw([
+            ('fill', 0, start, 0, 0, 0),
+            ('fill', start, stop, r, g, b),
+            ('fill', stop, count, 0, 0, 0),
+            ])
+
+    @staticmethod
+    def set_frame(data, start=0):
+        """Show packed RGB bytes on the leds beginning at led start"""
+        LightsController.draw([('bytes', start, bytes(data))])
+
+    @staticmethod
+    def set_pixels(updates):
+        """Show each (index, r, g, b) in the list of updates"""
+        LightsController.draw([('pixels', updates)])
+
     @staticmethod
     def get_random_color():
         """Gets a random color - RGB values"""
@@ -116,41 +322,25 @@ class LightsController(object):
         return color
 
     @staticmethod
-    def brightness_decrease(wait=0.01, step=1):
-        """Decrease the brightness until black"""
-        for j in range(int(256 // step)):
-            for i in range(LightsController.pixels.count()):
-                r, g, b = LightsController.pixels.get_pixel_rgb(i)
-                r = int(max(0, r - step))
-                g = int(max(0, g - step))
-                b = int(max(0, b - step))
-                # we don't need to check the is_rbg flag here because this decreases from the current values
-                LightsController.pixels.set_pixel_rgb(i, r, g, b)
-            LightsController.pixels.show()
-            # if we have reached black, then we are done
-            if r == 0 and g == 0 and b == 0:
-                break
-            if wait > 0:
-                time.sleep(wait)
+    def brightness_decrease(wait=0.01, step=1, easing='linear'):
+        """Fade the current frame to black
+           This takes as long as stepping the brightest value down by step every
+           wait seconds, it is a generator which yields the wait after each step
+        """
+        pixels = LightsController.pixels
+        duration = max(pixels.get_bytes() or b'\0') / step * wait
+        return fade.fade(pixels, bytes(pixels.count() * 3), duration, easing)
 
     @staticmethod
-    def brightness_increase(wait=0.01, step=1):
-        """Increase the brightness until full"""
-        for j in range(int(256 // step)):
-            for i in range(LightsController.pixels.count()):
-                r = int(min(j, config.color['r']))
-                g = int(min(j, config.color['g']))
-                b = int(min(j, config.color['b']))
-                if config.is_rbg:
-                    LightsController.pixels.set_pixel_rgb(i, r, b, g)
-                else:
-                    LightsController.pixels.set_pixel_rgb(i, r, g, b)
-            LightsController.pixels.show()
-            # if we have reached the full color, then we are done
-            if r == config.color['r'] and g == config.color['g'] and b == config.color['b']:
-                break
-            if wait > 0:
-                time.sleep(wait)
+    def brightness_increase(wait=0.01, step=1, easing='linear'):
+        """Fade the current frame to all leds at the current color
+           This takes as long as stepping the brightest value up by step every
+           wait seconds, it is a generator which yields the wait after each step
+        """
+        pixels = LightsController.pixels
+        target = bytes(LightsController.rgb()) * pixels.count()
+        duration = max(LightsController.rgb()) / step * wait
+        return fade.fade(pixels, target, duration, easing)
     
     @staticmethod
     def wheel(pos):
@@ -164,33 +354,261 @@ class LightsController(object):
             pos -= 170
             return Adafruit_WS2801.RGB_to_color(0, pos * 3, 255 - pos * 3)
 
+    @staticmethod
+    def build_tables():
+        """Precompute the 256 color wheel entries and the wheel offset of each
+           pixel used by the rainbow patterns.
+           The tables are only rebuilt when the pixel count has changed.
+        """
+        count = LightsController.pixels.count()
+        key = count
+        if LightsController.tables_key == key:
+            return
+        if frames.enabled:
+            LightsController.wheel_table = frames.wheel_table()
+            LightsController.phase_table = frames.phase_table(count)
+        else:
+            LightsController.wheel_table = []
+            for pos in range(256):
+                LightsController.wheel_table.append(bytes(Adafruit_WS2801.color_to_RGB(LightsController.wheel(pos))))
+            LightsController.phase_table = [i * 256 // count for i in range(count)]
+        LightsController.tables_key = key
+
+    @staticmethod
+    def set_wheel_frame(step):
+        """Set each pixel to its own position on the color wheel offset by step
+           This is a single gather from the precomputed tables into the pixel buffer
+        """
+        LightsController.build_tables()
+        wheel = LightsController.wheel_table
+        if frames.enabled:
+            frames.gather(wheel, LightsController.phase_table + (step & 0xFF), LightsController.pixels.buffer())
+        else:
+            LightsController.pixels.set_bytes(b''.join([wheel[(i + step) & 0xFF] for i in LightsController.phase_table]))
+
+    @staticmethod
+    def wheel_rgb(pos):
+        """The (r, g, b) values of the given position on the color wheel"""
+        LightsController.build_tables()
+        return tuple(bytes(LightsController.wheel_table[pos & 0xFF]))
+
+    @staticmethod
+    def set_wheel_color(pos):
+        """Set all pixels to the given position on the color wheel"""
+        LightsController.build_tables()
+        LightsController.pixels.fill(*LightsController.wheel_table[pos & 0xFF])
+
     @staticmethod
     def start_pattern(pattern='fill_up', delay=0.1, pause=0.5, rounds=0):
-        """Start a running pattern.  This is done by forking a new process to 
-           run the pattern so that it will run indefinitely.
-           There can only be one forked process at a time.
+        """Start a running pattern.  The pattern is handed to the render worker
+           which switches to it at the next frame boundary and runs it
+           indefinitely (or for the given number of rounds).
+           There can only be one pattern running at a time.
+           Raises ValueError if the pattern is unknown or the delay, pause or
+           rounds is not a number.
         """
-        LightsController.stop_existing_process()
-        LightsController.process = Process(target=globals()[pattern], args=(delay, pause, rounds))
-        LightsController.process.start()
+        delay = float(delay)
+        pause = float(pause)
+        rounds = int(rounds)
+        check_pattern(pattern)
+        LightsController.worker.start_pattern(pattern, delay, pause, rounds)
+        LightsController.state.update(pattern={'pattern': pattern, 'delay': delay, 'pause': pause, 'rounds': rounds})
     
     @staticmethod
-    def stop_existing_process():
-        """Stop an existing process if there is one
-           Running through uwsgi it seems that SIGKILL is necessary as
-           .terminate() did not work.  It seems the process ignores the SIGTERM signal.
+    def pattern_finished(pattern):
+        """Called by the render worker when a pattern finishes by itself, so it
+           isn't resumed at the next startup
         """
-        if LightsController.process is not None and LightsController.process.is_alive():
-            #LightsController.process.terminate()
-            try:
-                os.kill(LightsController.process.pid, signal.SIGKILL)
-                # wait for the process in order to reap it (avoids having defunct zombie processes leftover)
-                os.waitpid(LightsController.process.pid, 0)
-            except OSError:
-                pass
-            except Exception as e:
-                logging.exception('Error in stop_existing_process')
-    
+        LightsController.state.remove('pattern', lambda saved: isinstance(saved, dict) and saved.get('pattern') == pattern)
+
+    @staticmethod
+    def start_recording(name):
+        """Start recording the frames pushed to the lights into the named sequence"""
+        LightsController.worker.send('record', LightsController.get_sequence_path(name), 'RGB')
+
+    @staticmethod
+    def stop_recording():
+        """Stop recording frames"""
+        LightsController.worker.send('record', None, None)
+
+    @staticmethod
+    def get_sequence_path(name):
+        """Returns the file for the named sequence (in the sequences directory)"""
+        if not os.path.exists(config.path_sequences):
+            os.makedirs(config.path_sequences)
+        return os.path.join(config.path_sequences, os.path.basename(name) + '.seq')
+
+def pattern_steps(pattern, delay=0.1, pause=0.5, rounds=0):
+    """Returns the generator for the named pattern
+       A recorded sequence can be played with the name sequence:<name> and
+       several patterns can be run as layers by joining them with + (see
+       layered_steps)
+    """
+    if '+' in pattern:
+        return layered_steps(pattern, delay, pause, rounds)
+    if pattern.startswith('sequence:'):
+        path = LightsController.get_sequence_path(pattern[len('sequence:'):])
+        return sequence.play(LightsController.pixels, path, rounds)
+    if pattern not in registry:
+        raise ValueError('Unknown pattern: %s' % pattern)
+    if pattern in cached_patterns and LightsController.frame_cache.budget > 0:
+        return cached_steps(pattern, delay, pause, rounds)
+    return registry[pattern](delay, pause, rounds)
+
+def check_pattern(pattern):
+    """Raises ValueError if the pattern is not a known pattern, a recorded
+       sequence or a valid set of layers (see pattern_steps)
+    """
+    if '+' in pattern:
+        for spec in pattern.split('+'):
+            parts = spec.split(':')
+            check_pattern(parts[0])
+            if len(parts) > 3 or (len(parts) > 1 and parts[1] not in compositor.MODES):
+                raise ValueError('Invalid layer: %s' % spec)
+            if len(parts) > 2:
+                try:
+                    float(parts[2])
+                except ValueError:
+                    raise ValueError('Invalid opacity: %s' % parts[2])
+    elif pattern.startswith('sequence:'):
+        if not os.path.exists(LightsController.get_sequence_path(pattern[len('sequence:'):])):
+            raise ValueError('Unknown sequence: %s' % pattern[len('sequence:'):])
+    elif pattern not in registry:
+        raise ValueError('Unknown pattern: %s' % pattern)
+
+def is_level(value):
+    """Returns True if the value is a color or brightness level (an int from 0 to 255)"""
+    return isinstance(value, int) and not isinstance(value, bool) and 0 <= value <= 255
+
+def layered_steps(pattern, delay=0.1, pause=0.5, rounds=0):
+    """Run several patterns as layers, from the bottom up, e.g.
+         rainbow_cycle+chase_up:replace+fill_up:alpha:0.3
+       Each layer above the first can give its blend mode (replace, add, max or
+       alpha, default replace) and for alpha the opacity (default 0.5).
+    """
+    layers = []
+    for spec in pattern.split('+'):
+        parts = spec.split(':')
+        mode = parts[1] if len(parts) > 1 else 'replace'
+        opacity = float(parts[2]) if len(parts) > 2 else 0.5
+        canvas = Adafruit_WS2801.WS2801Pixels(LightsController.pixels.count(), spi=NullSpi(), latch=0)
+        steps = lambda name=parts[0]: pattern_steps(name, delay, pause, rounds)
+        layers.append(compositor.Layer(canvas, steps, mode, opacity))
+    return compositor.composite(LightsController.pixels, layers, select_pixels)
+
+def select_pixels(pixels):
+    """Make the patterns draw into pixels"""
+    LightsController.pixels = pixels
+
+def cached_steps(pattern, delay=0.1, pause=0.5, rounds=0):
+    """Run a periodic pattern from the frame cache
+       The first round is rendered as normal and recorded, after that the
+       recorded frames are replayed.  If the color changes the round is
+       rendered (and cached) again for the new color.
+       A round which is larger than the cache's budget stops being recorded as
+       soon as it goes over, and the pattern carries on uncached.
+    """
+    done = False
+    current_round = rounds
+    while not done:
+        key = cache_key(pattern, delay, pause)
+        cycle = LightsController.frame_cache.get(key)
+        if cycle is None:
+            cycle = []
+            size = 0
+            for wait in registry[pattern](delay, pause, 1):
+                if cycle is not None:
+                    frame = LightsController.pixels.get_bytes()
+                    size += len(frame)
+                    if size > LightsController.frame_cache.budget:
+                        cycle = None
+                    else:
+                        cycle.append((frame, wait))
+                yield wait
+            if cycle is None:
+                logging.debug('Pattern %s is too large for the frame cache', pattern)
+                if rounds == 0:
+                    yield from registry[pattern](delay, pause, 0)
+                elif current_round > 1:
+                    yield from registry[pattern](delay, pause, current_round - 1)
+                return
+            # only keep the round if nothing changed while it was recorded
+            if cache_key(pattern, delay, pause) == key:
+                LightsController.frame_cache.put(key, cycle)
+        else:
+            for frame, wait in cycle:
+                if cache_key(pattern, delay, pause) != key:
+                    break
+                LightsController.pixels.set_bytes(frame)
+                yield wait
+        if rounds > 0:
+            current_round -= 1
+            if current_round <= 0:
+                done = True
+
+def cache_key(pattern, delay, pause):
+    """The frame cache key, everything a cached pattern's frames depend on"""
+    return (pattern, delay, pause, LightsController.pixels.count(),
+            config.color['r'], config.color['g'], config.color['b'])
+
+def register_pattern(function):
+    """Decorator adding a pattern function to the registry under its name"""
+    registry[function.__name__] = function
+    return function
+
+def frame_program(pattern):
+    """Decorator adding a frame program for the pattern, which lets the render
+       pool render the pattern's frames in any order (see pool.py).
+       A frame program takes the pattern's delay and pause and the seed for the
+       round's random choices, and returns (count, render): the number of
+       frames in one round of the pattern and render(pixels, index) which draws
+       frame index of the round from scratch and returns its wait.  The frames
+       must be the same as those of the pattern's rounds and must not depend
+       on the time.
+    """
+    def add(function):
+        frame_programs[pattern] = function
+        return function
+    return add
+
+def set_pixels_rgb(pixels, lights, r, g, b):
+    """Set the leds in the list lights to the color"""
+    if frames.enabled:
+        frames.as_frame(pixels.buffer())[lights] = (r, g, b)
+    else:
+        for light in lights:
+            pixels.set_pixel_rgb(light, r, g, b)
+
+def load_pattern_specs():
+    """Compile the patterns in the pattern specs file (if there is one) and add
+       them to the known patterns.  A pattern with the name of a built in
+       pattern is skipped.
+    """
+    if not os.path.exists(config.path_patterns):
+        return
+    try:
+        loaded = specs.load(config.path_patterns)
+    except (OSError, specs.SpecError):
+        logging.exception('Could not load the pattern specs %s', config.path_patterns)
+        return
+    for name, spec in loaded.items():
+        if name in registry and not getattr(registry[name], 'spec', False):
+            logging.warning('Pattern spec %s has the name of a built in pattern, skipped', name)
+            continue
+        try:
+            function = specs.compile_pattern(name, spec, LightsController)
+        except specs.SpecError as e:
+            logging.error('Skipped pattern spec %s: %s', name, e)
+            continue
+        function.prepare(config.pixel_count)
+        function.spec = True
+        registry[name] = function
+        if name not in patterns:
+            patterns.append(name)
+        if function.deterministic and name not in cached_patterns:
+            cached_patterns.append(name)
+        logging.info('Loaded pattern spec %s', name)
+
 # Define all light patterns
 # Each pattern function should take three parameters:
 #   delay - lengh of the delay used in the pattern
@@ -198,186 +616,216 @@ class LightsController(object):
 #   rounds - the number of rounds to do before finishing
 #
 # A pattern should run indefinitely if the number of rounds is 0.
+#
+# Patterns are generators: they update the pixels without calling show() and
+# then yield the number of seconds the frame should be displayed for.  The
+# frame scheduler (see run_pattern) takes care of pushing the frames and
+# keeping to the requested timing.
+#
+# Each pattern is added to the registry with the register_pattern decorator.
 
+@register_pattern
 def all_random(delay=0, pause=0.5, rounds=0):
-    LightsController.off(stop_existing=False)
-    done = False
-    current_round = rounds
-    try:
-        while not done:
-            # get random pattern
-            pattern = random.sample(patterns, 1)[0]
-            # get random values
-            pattern_delay = random.uniform(0.005, 0.05)
-            pattern_pause = random.uniform(0.5, 5)
-            pattern_rounds = random.randint(3, 6)
-            logging.debug("Doing %s delay %s pause %s rounds %d", pattern, str(pattern_delay), str(pattern_pause), pattern_rounds)
-            globals()[pattern](pattern_delay, pattern_pause, pattern_rounds)
-            time.sleep(delay)
-            if rounds > 0:
-                current_round -= 1
-                if current_round <= 0:
-                    done = True
-    except Exception as e:
-        logging.exception('Error in all_random')
+    # each round is one entry of the playlist, see playlist.py
+    LightsController.off(stop_existing=False, show=False)
+    count = LightsController.pixels.count()
+    canvases = [Adafruit_WS2801.WS2801Pixels(count, spi=NullSpi(), latch=0) for i in range(2)]
+    random_playlist = playlist.Playlist(lambda: patterns, config.playlist_seed)
+    steps = lambda entry: registry[entry.pattern](entry.delay, entry.pause, entry.rounds)
+    yield from playlist.play(LightsController.pixels, random_playlist, steps, canvases, select_pixels, delay, rounds)
     
+@register_pattern
 def chase_up(delay=0.1, pause=0.5, rounds=0):
-    LightsController.off(stop_existing=False)
+    LightsController.off(stop_existing=False, show=False)
     done = False
     current_round = rounds
     while not done:
         for light in pattern_lights:
-            LightsController.on([light], stop_existing=False)
-            time.sleep(delay)
-            LightsController.off([light], stop_existing=False)
-        time.sleep(pause)
+            LightsController.on([light], stop_existing=False, show=False)
+            yield delay
+            LightsController.off([light], stop_existing=False, show=False)
+        yield pause
         if rounds > 0:
             current_round -= 1
             if current_round <= 0:
                 done = True
         
+@register_pattern
 def chase_down(delay=0.1, pause=0.5, rounds=0):
-    LightsController.off(stop_existing=False)
+    LightsController.off(stop_existing=False, show=False)
     done = False
     current_round = rounds
     while not done:
         for light in pattern_lights[::-1]:
-            LightsController.on([light], stop_existing=False)
-            time.sleep(delay)
-            LightsController.off([light], stop_existing=False)
-        time.sleep(pause)
+            LightsController.on([light], stop_existing=False, show=False)
+            yield delay
+            LightsController.off([light], stop_existing=False, show=False)
+        yield pause
         if rounds > 0:
             current_round -= 1
             if current_round <= 0:
                 done = True
 
+@register_pattern
 def fill_up(delay=0.1, pause=0.5, rounds=0):
-    LightsController.off(stop_existing=False)
+    LightsController.off(stop_existing=False, show=False)
     done = False
     current_round = rounds
     while not done:
         for light in pattern_lights:
-            LightsController.on([light], stop_existing=False)
-            time.sleep(delay)
-        time.sleep(pause)
-        LightsController.off(stop_existing=False)
-        time.sleep(delay)
+            LightsController.on([light], stop_existing=False, show=False)
+            yield delay
+        yield pause
+        LightsController.off(stop_existing=False, show=False)
+        yield delay
         if rounds > 0:
             current_round -= 1
             if current_round <= 0:
                 done = True
 
+@register_pattern
 def fill_down(delay=0.1, pause=0.5, rounds=0):
-    LightsController.off(stop_existing=False)
+    LightsController.off(stop_existing=False, show=False)
     done = False
     current_round = rounds
     while not done:
         for light in pattern_lights[::-1]:
-            LightsController.on([light], stop_existing=False)
-            time.sleep(delay)
-        time.sleep(pause)
-        LightsController.off(stop_existing=False)
-        time.sleep(delay)
+            LightsController.on([light], stop_existing=False, show=False)
+            yield delay
+        yield pause
+        LightsController.off(stop_existing=False, show=False)
+        yield delay
         if rounds > 0:
             current_round -= 1
             if current_round <= 0:
                 done = True
 
+@register_pattern
 def fill_up_and_down(delay=0.1, pause=0.5, rounds=0):
-    LightsController.off(stop_existing=False)
+    LightsController.off(stop_existing=False, show=False)
     done = False
     current_round = rounds
     while not done:
         for light in pattern_lights:
-            LightsController.on([light], stop_existing=False)
-            time.sleep(delay)
-        time.sleep(pause)
+            LightsController.on([light], stop_existing=False, show=False)
+            yield delay
+        yield pause
         for light in pattern_lights[::-1]:
-            LightsController.off([light], stop_existing=False)
-            time.sleep(delay)
-        time.sleep(pause)
+            LightsController.off([light], stop_existing=False, show=False)
+            yield delay
+        yield pause
         if rounds > 0:
             current_round -= 1
             if current_round <= 0:
                 done = True
                 
+@register_pattern
 def fill_up_chase_up(delay=0.1, pause=0.5, rounds=0):
-    LightsController.off(stop_existing=False)
+    LightsController.off(stop_existing=False, show=False)
     done = False
     current_round = rounds
     while not done:
         for light in pattern_lights:
-            LightsController.on([light], stop_existing=False)
-            time.sleep(delay)
+            LightsController.on([light], stop_existing=False, show=False)
+            yield delay
         for light in pattern_lights:
-            LightsController.off([light], stop_existing=False)
-            time.sleep(delay)
-        time.sleep(pause)
-        LightsController.off(stop_existing=False)
-        time.sleep(delay)
+            LightsController.off([light], stop_existing=False, show=False)
+            yield delay
+        yield pause
+        LightsController.off(stop_existing=False, show=False)
+        yield delay
         if rounds > 0:
             current_round -= 1
             if current_round <= 0:
                 done = True
 
+@register_pattern
 def alternating(delay=0.1, pause=0.5, rounds=0):
-    LightsController.off(stop_existing=False)
+    LightsController.off(stop_existing=False, show=False)
     done = False
     current_round = rounds
     group1 = [i for i in pattern_lights if i % 2]
     group2 = [i for i in pattern_lights if i % 2 == 0]
     while not done:
-        LightsController.off(group2, stop_existing=False)
-        time.sleep(delay)
-        LightsController.on(group1, stop_existing=False)
-        time.sleep(pause)
-        LightsController.on(group2, stop_existing=False)
-        time.sleep(delay)
-        LightsController.off(group1, stop_existing=False)
-        time.sleep(pause)
+        LightsController.off(group2, stop_existing=False, show=False)
+        yield delay
+        LightsController.on(group1, stop_existing=False, show=False)
+        yield pause
+        LightsController.on(group2, stop_existing=False, show=False)
+        yield delay
+        LightsController.off(group1, stop_existing=False, show=False)
+        yield pause
         if rounds > 0:
             current_round -= 1
             if current_round <= 0:
                 done = True
 
+@register_pattern
 def random_sets(delay=0.1, pause=0.5, rounds=0):
-    LightsController.off(stop_existing=False)
+    LightsController.off(stop_existing=False, show=False)
     done = False
     current_round = rounds
     while not done:
         # get a random half from the available lights
         lights = random.sample(pattern_lights, config.pixel_count // 2)
-        LightsController.on(lights, stop_existing=False)
-        time.sleep(pause)
-        LightsController.off(lights, stop_existing=False)
+        LightsController.on(lights, stop_existing=False, show=False)
+        yield pause
+        LightsController.off(lights, stop_existing=False, show=False)
         if rounds > 0:
             current_round -= 1
             if current_round <= 0:
                 done = True
+    # show the final off
+    yield 0
 
+@register_pattern
 def random_on_off(delay=0.1, pause=0.5, rounds=0):
-    LightsController.off(stop_existing=False)
+    LightsController.off(stop_existing=False, show=False)
     done = False
     current_round = rounds
     lights = list(pattern_lights)
     while not done:
         random.shuffle(lights)
         for light in lights:
-            LightsController.on([light], stop_existing=False)
-            time.sleep(delay)
-        time.sleep(pause)
+            LightsController.on([light], stop_existing=False, show=False)
+            yield delay
+        yield pause
         random.shuffle(lights)
         for light in lights:
-            LightsController.off([light], stop_existing=False)
-            time.sleep(delay)
-        time.sleep(pause)
+            LightsController.off([light], stop_existing=False, show=False)
+            yield delay
+        yield pause
         if rounds > 0:
             current_round -= 1
             if current_round <= 0:
                 done = True
 
+@frame_program('random_on_off')
+def random_on_off_frames(delay=0.1, pause=0.5, seed=0):
+    count = config.pixel_count
+    rng = random.Random(seed)
+    on = list(range(count))
+    rng.shuffle(on)
+    off = list(range(count))
+    rng.shuffle(off)
+
+    # the lights are turned on one per frame followed by the pause, then
+    # turned off one per frame followed by the pause
+    def render(pixels, index):
+        r, g, b = LightsController.rgb()
+        if index <= count:
+            pixels.clear()
+            set_pixels_rgb(pixels, on[:index + 1], r, g, b)
+            return delay if index < count else pause
+        index -= count + 1
+        pixels.fill(r, g, b)
+        set_pixels_rgb(pixels, off[:index + 1], 0, 0, 0)
+        return delay if index < count else pause
+    return 2 * count + 2, render
+
+@register_pattern
 def appear_from_back(delay=0.1, pause=0.5, rounds=0):
-    LightsController.off(stop_existing=False)
+    LightsController.off(stop_existing=False, show=False)
     done = False
     current_round = rounds
     while not done:
@@ -386,63 +834,83 @@ def appear_from_back(delay=0.1, pause=0.5, rounds=0):
             for j in reversed(range(i, config.pixel_count)):
                 LightsController.pixels.clear()
                 # first set all pixels at the beginning
-                for k in range(i):
-                    LightsController.set_color(k, show=False)
+                LightsController.set_color_range(0, i, show=False)
                 # set the pixel at position j and the 9 preceeding pixels
-                for m in range(max(j-9, 0), j+1):
-                    LightsController.set_color(m, show=False)
-                LightsController.pixels.show()
-                time.sleep(delay)
-        time.sleep(pause)
+                LightsController.set_color_range(max(j-9, 0), j+1, show=False)
+                yield delay
+        yield pause
         if rounds > 0:
             current_round -= 1
             if current_round <= 0:
                 done = True
 
+@frame_program('appear_from_back')
+def appear_from_back_frames(delay=0.1, pause=0.5, seed=0):
+    count = config.pixel_count
+    # the first frame of each block of 10
+    starts = []
+    total = 0
+    for i in range(0, count, 10):
+        starts.append(total)
+        total += count - i
+
+    def render(pixels, index):
+        wait = delay
+        if index >= total:
+            # the pause holds the last frame
+            index = total - 1
+            wait = pause
+        block = bisect.bisect_right(starts, index) - 1
+        i = block * 10
+        j = count - 1 - (index - starts[block])
+        r, g, b = LightsController.rgb()
+        pixels.clear()
+        pixels.fill_range(0, i, r, g, b)
+        pixels.fill_range(max(j-9, 0), j+1, r, g, b)
+        return wait
+    return total + 1, render
+
+@register_pattern
 def fade_in_out(delay=0.1, pause=0.5, rounds=0):
-    LightsController.off(stop_existing=False)
+    LightsController.off(stop_existing=False, show=False)
     done = False
     current_round = rounds
     while not done:
-        LightsController.brightness_increase(wait=delay)
-        time.sleep(pause)
-        LightsController.brightness_decrease(wait=delay)
-        time.sleep(pause)
+        yield from LightsController.brightness_increase(wait=delay)
+        yield pause
+        yield from LightsController.brightness_decrease(wait=delay)
+        yield pause
         if rounds > 0:
             current_round -= 1
             if current_round <= 0:
                 done = True
 
+@register_pattern
 def rainbow_cycle(delay=0.005, pause=0.5, rounds=0):
-    LightsController.off(stop_existing=False)
+    LightsController.off(stop_existing=False, show=False)
     done = False
     current_round = rounds
     while not done:
         for j in range(256): # one cycle of all 256 colors in the wheel
-            for i in pattern_lights:
-                LightsController.pixels.set_pixel(i, LightsController.wheel(((i * 256 // LightsController.pixels.count()) + j) % 256) )
-            LightsController.pixels.show()
-            if delay > 0:
-                time.sleep(delay)
-        time.sleep(pause)
+            LightsController.set_wheel_frame(j)
+            yield delay
+        yield pause
         if rounds > 0:
             current_round -= 1
             if current_round <= 0:
                 done = True
 
+@register_pattern
 def rainbow_colors(delay=0.05, pause=0.5, rounds=0):
-    LightsController.off(stop_existing=False)
+    LightsController.off(stop_existing=False, show=False)
     done = False
     current_round = rounds
     while not done:
         for j in range(256): # one cycle of all 256 colors in the wheel
-            for i in pattern_lights:
-                LightsController.pixels.set_pixel(i, LightsController.wheel(((256 // LightsController.pixels.count() + j)) % 256) )
-            LightsController.pixels.show()
-            if delay > 0:
-                time.sleep(delay)
-        time.sleep(pause)
+            LightsController.set_wheel_color(256 // LightsController.pixels.count() + j)
+            yield delay
+        yield pause
         if rounds > 0:
             current_round -= 1
             if current_round <= 0:
-                done = True
\ No newline at end of file
+                done = True
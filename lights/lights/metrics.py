@@ -0,0 +1,181 @@
+# Counters and histograms for the render and SPI paths
+# Copyright Notice
+#
+# The values are kept in an anonymous shared mapping which is created at
+# import, before the render worker is forked, so the web process can export
+# the numbers recorded by the worker in the Prometheus text format.  Every
+# metric is only written by one process; the metrics used by the worker must
+# be defined at import (see the bottom of this file), labelled children which
+# are created later are only used by the process that created them.
+#
+# When metrics are disabled in the config the metric objects are no-ops.
+
+import bisect
+import mmap
+import os
+import threading
+
+import config
+
+# flag designating that metrics are collected
+enabled = config.metrics_enabled
+
+# buckets (in seconds) for the timing histograms
+TIME_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# number of values which can be stored
+SLOTS = 4096
+
+_values = memoryview(mmap.mmap(-1, SLOTS * 8)).cast('d') if enabled else None
+_next_slot = 0
+_metrics = []
+_lock = threading.Lock()
+
+def _reset_lock():
+    # the lock may have been held by another thread when the worker was forked
+    global _lock
+    _lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_lock)
+
+def _allocate(count):
+    global _next_slot
+    with _lock:
+        if _next_slot + count > SLOTS:
+            raise RuntimeError('Out of metric slots')
+        slot = _next_slot
+        _next_slot += count
+    return slot
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels)
+
+
+class NullMetric(object):
+    """Metric which does nothing, used when metrics are disabled"""
+
+    def inc(self, value=1):
+        pass
+
+    def observe(self, value):
+        pass
+
+    def labels(self, *values):
+        return self
+
+
+class Counter(object):
+    """Monotonically increasing count"""
+
+    type = 'counter'
+
+    def __init__(self, name, help, labelnames=(), labels=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.label_values = labels
+        self.children = {}
+        self.slot = None if labelnames else _allocate(1)
+
+    def labels(self, *values):
+        """Returns the child metric for the label values"""
+        child = self.children.get(values)
+        if child is None:
+            child = self.children.setdefault(values, self.child(tuple(zip(self.labelnames, values))))
+        return child
+
+    def child(self, labels):
+        return Counter(self.name, self.help, labels=labels)
+
+    def inc(self, value=1):
+        with _lock:
+            _values[self.slot] += value
+
+    def samples(self):
+        if self.slot is None:
+            for child in list(self.children.values()):
+                for sample in child.samples():
+                    yield sample
+        else:
+            yield self.name, self.label_values, _values[self.slot]
+
+
+class Histogram(Counter):
+    """Distribution of observed values in fixed buckets"""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), labels=(), buckets=TIME_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.label_values = labels
+        self.children = {}
+        self.buckets = buckets
+        # one slot per bucket plus +Inf, then the sum
+        self.slot = None if labelnames else _allocate(len(buckets) + 2)
+
+    def child(self, labels):
+        return Histogram(self.name, self.help, labels=labels, buckets=self.buckets)
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            _values[self.slot + index] += 1
+            _values[self.slot + len(self.buckets) + 1] += value
+
+    def samples(self):
+        if self.slot is None:
+            for child in list(self.children.values()):
+                for sample in child.samples():
+                    yield sample
+            return
+        total = 0
+        for i, bound in enumerate(self.buckets + (float('inf'),)):
+            total += _values[self.slot + i]
+            yield self.name + '_bucket', self.label_values + (('le', '+Inf' if bound == float('inf') else repr(bound)),), total
+        yield self.name + '_sum', self.label_values, _values[self.slot + len(self.buckets) + 1]
+        yield self.name + '_count', self.label_values, total
+
+
+def counter(name, help, labelnames=()):
+    metric = Counter(name, help, labelnames) if enabled else NullMetric()
+    if enabled:
+        _metrics.append(metric)
+    return metric
+
+def histogram(name, help, labelnames=(), buckets=TIME_BUCKETS):
+    metric = Histogram(name, help, labelnames, buckets=buckets) if enabled else NullMetric()
+    if enabled:
+        _metrics.append(metric)
+    return metric
+
+def render():
+    """Returns all metrics in the Prometheus text format"""
+    lines = []
+    for metric in _metrics:
+        lines.append('# HELP %s %s' % (metric.name, metric.help))
+        lines.append('# TYPE %s %s' % (metric.name, metric.type))
+        for name, labels, value in metric.samples():
+            lines.append('%s%s %s' % (name, _format_labels(labels), repr(float(value))))
+    return '\n'.join(lines) + '\n'
+
+
+# render path (written by the render worker)
+render_seconds = histogram('lights_render_seconds', 'Time taken to render a frame')
+show_seconds = histogram('lights_show_seconds', 'Time taken by show() to push a frame')
+bytes_written = counter('lights_bytes_written_total', 'Bytes written to the lights')
+frames = counter('lights_frames_total', 'Frames produced by patterns by result', ('result',))
+frames_pushed = frames.labels('pushed')
+frames_unchanged = frames.labels('unchanged')
+frames_late = frames.labels('late')
+frames_skipped = frames.labels('skipped')
+pool_wait_seconds = histogram('lights_pool_wait_seconds', 'Time spent waiting for a frame from the render pool')
+switch_seconds = histogram('lights_pattern_switch_seconds', 'Time from start_pattern until the new pattern is running')
+stop_seconds = histogram('lights_pattern_stop_seconds', 'Time from a stop or draw command until the pattern has stopped')
+
+# web process
+request_seconds = histogram('lights_request_seconds', 'Web request latency by route', ('route',))
@@ -0,0 +1,125 @@
+# Playlist of random patterns
+# Copyright Notice
+#
+# all_random plays a playlist of patterns with random parameters.  The next
+# entry is decided ahead of time and prepared during the current pattern's
+# pause: its generator is created and its first frame drawn into a canvas of
+# its own, so any setup the pattern does (building its groups of lights,
+# shuffling them) happens while the lights are holding a frame anyway.  When
+# the current pattern finishes the prepared frame is copied into the pixels,
+# so the switch is made at the deadline without a stall.
+#
+# Each pattern draws into its canvas which is copied into the pixels after
+# every step.  With a seed the entries, and the random choices made by the
+# patterns themselves, are the same on every run.
+
+import collections
+import logging
+import random
+import time
+
+# a pattern with its parameters, seed is used to seed the random choices of
+# the pattern when the playlist is seeded
+Entry = collections.namedtuple('Entry', 'pattern delay pause rounds seed')
+
+class Playlist(object):
+    """Decides the entries, the patterns are chosen from the names returned by
+       choices() so that patterns loaded later are included
+    """
+
+    # ranges of the random parameters
+    DELAY = (0.005, 0.05)
+    PAUSE = (0.5, 5)
+    ROUNDS = (3, 6)
+
+    def __init__(self, choices, seed=None):
+        self.choices = choices
+        self.seeded = seed is not None
+        self.random = random.Random(seed)
+
+    def next_entry(self):
+        rng = self.random
+        return Entry(rng.choice(self.choices()), rng.uniform(*self.DELAY), rng.uniform(*self.PAUSE),
+                     rng.randint(*self.ROUNDS), rng.getrandbits(32))
+
+
+class Prepared(object):
+    """An entry whose generator has been created and first frame drawn"""
+
+    def __init__(self, entry, canvas, generator, wait):
+        self.entry = entry
+        self.canvas = canvas
+        self.generator = generator
+        # the wait of the first frame, None if the pattern had no frames
+        self.wait = wait
+
+
+def prepare(playlist, canvas, steps, select, pixels):
+    """Decide the next entry and draw its first frame into canvas"""
+    entry = playlist.next_entry()
+    started = time.perf_counter()
+    if playlist.seeded:
+        random.seed(entry.seed)
+    select(canvas)
+    try:
+        canvas.clear()
+        generator = steps(entry)
+        try:
+            wait = next(generator)
+        except StopIteration:
+            wait = None
+    finally:
+        select(pixels)
+    logging.debug('Prepared %s delay %s pause %s rounds %d in %.1f ms', entry.pattern, str(entry.delay),
+                  str(entry.pause), entry.rounds, (time.perf_counter() - started) * 1000)
+    return Prepared(entry, canvas, generator, wait)
+
+def play(pixels, playlist, steps, canvases, select, gap=0.0, entries=0):
+    """Generator which plays the playlist into pixels, for running with the
+       frame scheduler.  steps(entry) must return the entry's pattern
+       generator, select(canvas) is called to make the patterns draw into one of
+       the two canvases and select(pixels) to go back.
+       gap is the wait between the entries, the playlist runs for the given
+       number of entries or indefinitely if 0.
+    """
+    current = prepare(playlist, canvases[0], steps, select, pixels)
+    upcoming = None
+    played = 0
+    try:
+        while True:
+            entry = current.entry
+            last = entries > 0 and played + 1 >= entries
+            logging.debug('Doing %s delay %s pause %s rounds %d', entry.pattern, str(entry.delay),
+                          str(entry.pause), entry.rounds)
+            wait = current.wait
+            while wait is not None:
+                pixels.set_bytes(current.canvas.get_bytes())
+                if upcoming is None and not last and wait >= entry.pause:
+                    # show the frame now and prepare the next entry while it is
+                    # held, the scheduler's deadline still ends the pause on time
+                    yield 0.0
+                    other = canvases[1] if current.canvas is canvases[0] else canvases[0]
+                    upcoming = prepare(playlist, other, steps, select, pixels)
+                yield wait
+                select(current.canvas)
+                try:
+                    wait = next(current.generator)
+                except StopIteration:
+                    wait = None
+                finally:
+                    select(pixels)
+            current.generator.close()
+            played += 1
+            if last:
+                break
+            if upcoming is None:
+                # the pattern had no pause to prepare the next entry in
+                other = canvases[1] if current.canvas is canvases[0] else canvases[0]
+                upcoming = prepare(playlist, other, steps, select, pixels)
+            yield gap
+            current, upcoming = upcoming, None
+    finally:
+        select(pixels)
+        current.generator.close()
+        if upcoming is not None:
+            upcoming.generator.close()
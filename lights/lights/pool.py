@@ -0,0 +1,249 @@
+# Render pool for the expensive patterns
+# Copyright Notice
+#
+# The render worker renders the patterns and writes them to the lights one
+# after the other on a single core.  For the patterns listed in the [render]
+# section of the config the frames are instead rendered ahead by a pool of
+# processes into an ordered ring of frames in shared memory, and the render
+# worker takes them from the ring in order and pushes them at the pattern's
+# timing.
+#
+# The pattern generators carry their state from one frame to the next, so the
+# pool renders from frame programs instead (see frame_program in lights.py):
+# a frame program gives the number of frames in a round and draws any one of
+# them from its index alone.  Frame n is rendered by process n % workers into
+# slot n % slots of the ring, so all the processes render at the same time,
+# each a frame apart.  A process waits while the slot of its next frame has not
+# been taken yet, so the pool is never more than the ring's length ahead.
+# Patterns which are driven by the clock (e.g. fade_in_out) can't have a frame
+# program and are always rendered by the render worker.
+#
+# The render worker is a daemon process, which multiprocessing does not allow
+# to have children, so the pool processes are forked directly.  They are
+# started once, before the worker starts any threads, and wait for jobs.
+
+import logging
+import mmap
+import multiprocessing
+import os
+import queue
+import random
+import struct
+import time
+
+import config
+import metrics
+
+class FrameRing(object):
+    """Ring of frames in shared memory, each slot holds the frame's sequence
+       number, its wait and its packed RGB bytes.  A slot's free semaphore is
+       released when the slot can be written and its filled semaphore when it
+       can be read.
+    """
+
+    HEADER = struct.Struct('Qd')
+
+    def __init__(self, slots, frame_size):
+        self.slots = slots
+        self.frame_size = frame_size
+        self.slot_size = self.HEADER.size + frame_size
+        self.memory = mmap.mmap(-1, slots * self.slot_size)
+        self.view = memoryview(self.memory)
+        self.free = [multiprocessing.Semaphore(1) for i in range(slots)]
+        self.filled = [multiprocessing.Semaphore(0) for i in range(slots)]
+
+    def put(self, sequence, frame, wait, timeout=None):
+        """Write the frame into its slot, waiting while the slot is in use
+           Returns False if the slot didn't become free within timeout
+        """
+        slot = sequence % self.slots
+        if not self.free[slot].acquire(timeout=timeout):
+            return False
+        offset = slot * self.slot_size
+        self.HEADER.pack_into(self.memory, offset, sequence, wait)
+        self.view[offset + self.HEADER.size:offset + self.slot_size] = frame
+        self.filled[slot].release()
+        return True
+
+    def take(self, sequence, pixels, timeout=None):
+        """Copy the frame with the sequence number into pixels and returns its
+           wait, or None if it wasn't written within timeout
+        """
+        slot = sequence % self.slots
+        if not self.filled[slot].acquire(timeout=timeout):
+            return None
+        offset = slot * self.slot_size
+        written, wait = self.HEADER.unpack_from(self.memory, offset)
+        if written != sequence:
+            raise RuntimeError('Render pool frame %d is out of order (expected %d)' % (written, sequence))
+        pixels.set_bytes(self.view[offset + self.HEADER.size:offset + self.slot_size])
+        self.free[slot].release()
+        return wait
+
+    def reset(self):
+        """Empty the ring, nothing may be using it"""
+        for slot in range(self.slots):
+            while self.filled[slot].acquire(False):
+                pass
+            while self.free[slot].acquire(False):
+                pass
+            self.free[slot].release()
+
+
+class RenderPool(object):
+    """Renders the frames of a pattern ahead in several processes"""
+
+    # how long (in seconds) to wait on the ring before checking that the
+    # processes are still running or the job has been cancelled
+    POLL = 0.1
+
+    # how long (in seconds) to wait for the processes to finish a cancelled job
+    STOP_TIMEOUT = 2.0
+
+    def __init__(self, workers, slots, patterns, programs, canvas, shared):
+        """programs are the frame programs by pattern name, canvas() must return
+           a new WS2801Pixels to render into and shared is the SharedBlock
+           holding the color.  The ring holds at least slots frames, rounded up
+           to a multiple of workers so that each slot is always written by the
+           same process.
+        """
+        self.workers = workers
+        self.slots = -(-max(slots, 1) // max(workers, 1)) * max(workers, 1)
+        self.programs = programs
+        self.patterns = []
+        for pattern in patterns:
+            if pattern in programs:
+                self.patterns.append(pattern)
+            else:
+                logging.warning('Pattern %s has no frame program, it is not rendered by the render pool', pattern)
+        self.canvas = canvas
+        self.shared = shared
+        self.ring = None
+        self.jobs = []
+        self.pids = []
+        # incremented to cancel the current job, shared with the processes
+        self.generation = multiprocessing.RawValue('L', 0)
+        # released by each process when it has finished a job
+        self.done = multiprocessing.Semaphore(0)
+        # number of processes still working on the last job
+        self.busy = 0
+
+    def renders(self, pattern):
+        """Returns True if the pattern is rendered by the pool"""
+        return bool(self.pids) and pattern in self.patterns
+
+    def start(self, count):
+        """Fork the processes, for strips of count pixels
+           This has to be done before the calling process starts any threads.
+        """
+        if self.workers <= 0 or not self.patterns:
+            return
+        self.ring = FrameRing(self.slots, count * 3)
+        parent = os.getpid()
+        for index in range(self.workers):
+            jobs = multiprocessing.Queue()
+            pid = os.fork()
+            if pid == 0:
+                status = 0
+                try:
+                    self.serve(index, jobs, parent)
+                except Exception:
+                    logging.exception('Error in render pool process %d', index)
+                    status = 1
+                finally:
+                    os._exit(status)
+            self.jobs.append(jobs)
+            self.pids.append(pid)
+        logging.info('Render pool started with %d processes', self.workers)
+
+    def run(self, pixels, pattern, delay=0.1, pause=0.5, rounds=0):
+        """Generator which has the pool render the pattern and copies its frames
+           into pixels, for running with the frame scheduler.  stop() must be
+           called once the pattern is no longer being run.
+        """
+        self.finish()
+        count = self.programs[pattern](delay, pause, 0)[0]
+        seed = random.getrandbits(32)
+        for jobs in self.jobs:
+            jobs.put((self.generation.value, pattern, delay, pause, rounds, seed))
+        self.busy = self.workers
+        sequence = 0
+        while rounds == 0 or sequence < rounds * count:
+            started = time.perf_counter()
+            wait = self.ring.take(sequence, pixels, self.POLL)
+            while wait is None:
+                if not all(self.is_alive(pid) for pid in self.pids):
+                    logging.error('A render pool process has stopped, the pool is disabled')
+                    self.pids = []
+                    return
+                wait = self.ring.take(sequence, pixels, self.POLL)
+            metrics.pool_wait_seconds.observe(time.perf_counter() - started)
+            yield wait
+            sequence += 1
+
+    def stop(self):
+        """Cancel the current job, the processes stop at their next frame"""
+        self.generation.value += 1
+
+    def finish(self):
+        """Wait for the processes to finish the last job and empty the ring"""
+        if not self.busy:
+            return
+        self.stop()
+        end = time.monotonic() + self.STOP_TIMEOUT
+        while self.busy:
+            if not self.done.acquire(timeout=max(0.0, end - time.monotonic())):
+                logging.error('The render pool did not stop, the pool is disabled')
+                self.pids = []
+                return
+            self.busy -= 1
+        self.ring.reset()
+
+    def is_alive(self, pid):
+        try:
+            finished, status = os.waitpid(pid, os.WNOHANG)
+        except OSError:
+            return False
+        return finished == 0
+
+    def serve(self, index, jobs, parent):
+        """Main loop of a pool process"""
+        canvas = self.canvas()
+        while True:
+            try:
+                job = jobs.get(timeout=1.0)
+            except queue.Empty:
+                if os.getppid() != parent:
+                    # the render worker has gone
+                    return
+                continue
+            try:
+                self.produce(index, canvas, parent, *job)
+            except Exception:
+                logging.exception('Error rendering %s in the render pool', job[1])
+            self.done.release()
+
+    def produce(self, index, canvas, parent, generation, pattern, delay, pause, rounds, seed):
+        """Render every workers-th frame from index into the ring"""
+        # each round has its own random choices, the number of frames in a
+        # round is the same for all of them
+        count, render = self.programs[pattern](delay, pause, seed)
+        program_round = 0
+        color_version = None
+        sequence = index
+        while self.generation.value == generation:
+            current_round, frame = divmod(sequence, count)
+            if rounds > 0 and current_round >= rounds:
+                return
+            version = self.shared.state.color_version
+            if version != color_version:
+                color_version = version
+                config.color = self.shared.get_color()
+            if current_round != program_round:
+                count, render = self.programs[pattern](delay, pause, seed + current_round)
+                program_round = current_round
+            wait = render(canvas, frame)
+            while not self.ring.put(sequence, canvas.buffer(), wait, self.POLL):
+                if self.generation.value != generation or os.getppid() != parent:
+                    return
+            sequence += self.workers
@@ -0,0 +1,181 @@
+# Realtime frame input over UDP
+# Copyright Notice
+#
+# An external renderer on the LAN can stream frames straight to the lights.
+# Two packet formats are understood:
+#
+#   raw:   sequence number (uint8), start pixel (uint16, big endian),
+#          followed by RGB bytes (3 per pixel)
+#   e131:  E1.31 (sACN) data packets, each universe holds 170 pixels and the
+#          configured first universe starts at pixel 0
+#
+# Packets are received on a thread in the render worker and copied into a
+# staging frame, the worker copies the changed part into the pixels and pushes
+# it (see RenderWorker.run_realtime).  E1.31 is only received as unicast.
+
+import logging
+import socket
+import struct
+import threading
+
+RAW_HEADER = struct.Struct('>BH')
+
+E131_IDENTIFIER = b'ASC-E1.17\x00\x00\x00'
+E131_ROOT_VECTOR = 0x00000004
+E131_FRAMING_VECTOR = 0x00000002
+E131_DMP_VECTOR = 0x02
+# offsets into an E1.31 data packet
+E131_SEQUENCE = 111
+E131_OPTIONS = 112
+E131_UNIVERSE = 113
+E131_DATA = 126
+# the terminated bit of the options, the source has stopped sending
+E131_TERMINATED = 0x40
+# pixels per universe (512 channels / 3)
+E131_PIXELS = 170
+
+# a packet is stale if its sequence number is at most this far behind the last
+STALE_WINDOW = 20
+
+def is_stale(last, sequence):
+    """Returns True if the sequence number is a duplicate of or older than the last
+       The same rule as E1.31, anything further behind is taken as a restarted source
+    """
+    difference = (sequence - last) & 0xFF
+    if difference >= 128:
+        difference -= 256
+    return -STALE_WINDOW < difference <= 0
+
+def parse_raw(packet):
+    """Returns (sequence, universe, start pixel, data) for a raw packet or None if invalid"""
+    if len(packet) < RAW_HEADER.size:
+        return None
+    sequence, start = RAW_HEADER.unpack_from(packet)
+    data = packet[RAW_HEADER.size:]
+    if len(data) % 3 != 0:
+        return None
+    return sequence, 0, start, data
+
+def parse_e131(packet, first_universe=1):
+    """Returns (sequence, universe, start pixel, data) for an E1.31 data packet or
+       None if the packet is invalid, has been terminated or is for another universe
+    """
+    if len(packet) < E131_DATA or packet[4:16] != E131_IDENTIFIER:
+        return None
+    root, = struct.unpack_from('>I', packet, 18)
+    framing, = struct.unpack_from('>I', packet, 40)
+    if root != E131_ROOT_VECTOR or framing != E131_FRAMING_VECTOR or packet[117] != E131_DMP_VECTOR:
+        return None
+    # only the default (null) start code carries levels
+    if packet[125] != 0 or packet[E131_OPTIONS] & E131_TERMINATED:
+        return None
+    universe, = struct.unpack_from('>H', packet, E131_UNIVERSE)
+    if universe < first_universe:
+        return None
+    # the property value count includes the start code
+    count, = struct.unpack_from('>H', packet, 123)
+    length = min(count - 1, len(packet) - E131_DATA, E131_PIXELS * 3)
+    length -= length % 3
+    return packet[E131_SEQUENCE], universe, (universe - first_universe) * E131_PIXELS, \
+        packet[E131_DATA:E131_DATA + length]
+
+
+class RealtimeReceiver(object):
+    """Receives frames over UDP into a staging frame of pixel_count RGB pixels
+       notify() is called when new data is available, it is not called again
+       until the data has been taken with apply()
+    """
+
+    PACKET_SIZE = 65536
+
+    def __init__(self, pixel_count, notify, port, protocol='raw', universe=1, address=''):
+        if protocol not in ('raw', 'e131'):
+            raise ValueError('Unknown realtime protocol: %s' % protocol)
+        self.pixel_count = pixel_count
+        self.notify = notify
+        self.protocol = protocol
+        self.universe = universe
+        self.frame = bytearray(pixel_count * 3)
+        self.lock = threading.Lock()
+        self.dirty_start = pixel_count
+        self.dirty_stop = 0
+        self.notified = False
+        # last sequence number by (source address, universe)
+        self.sequences = {}
+        self.received = 0
+        self.dropped = 0
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((address, port))
+        self.thread = None
+
+    def start(self):
+        """Start receiving on a daemon thread"""
+        self.thread = threading.Thread(target=self.run, name='lights-realtime')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        buffer = bytearray(self.PACKET_SIZE)
+        view = memoryview(buffer)
+        while True:
+            try:
+                size, source = self.socket.recvfrom_into(buffer)
+            except OSError:
+                # the socket was closed
+                break
+            try:
+                self.receive(view[:size], source)
+            except Exception:
+                logging.exception('Error receiving realtime packet from %s', source[0])
+
+    def receive(self, packet, source):
+        """Copy a packet into the staging frame
+           Returns False if the packet was invalid or stale
+        """
+        if self.protocol == 'e131':
+            parsed = parse_e131(packet, self.universe)
+        else:
+            parsed = parse_raw(packet)
+        if parsed is None:
+            self.dropped += 1
+            return False
+        sequence, universe, start, data = parsed
+        key = (source[0], universe)
+        last = self.sequences.get(key)
+        if last is not None and is_stale(last, sequence):
+            self.dropped += 1
+            return False
+        self.sequences[key] = sequence
+        stop = min(start + len(data) // 3, self.pixel_count)
+        if stop <= start:
+            self.dropped += 1
+            return False
+        with self.lock:
+            self.frame[start * 3:stop * 3] = data[:(stop - start) * 3]
+            self.dirty_start = min(self.dirty_start, start)
+            self.dirty_stop = max(self.dirty_stop, stop)
+            notify = not self.notified
+            self.notified = True
+        self.received += 1
+        if notify:
+            self.notify()
+        return True
+
+    def apply(self, pixels):
+        """Copy the pixels which changed since the last call into pixels
+           Returns False if nothing has changed
+        """
+        with self.lock:
+            self.notified = False
+            if self.dirty_stop <= self.dirty_start:
+                return False
+            data = self.frame[self.dirty_start * 3:self.dirty_stop * 3]
+            start = self.dirty_start
+            self.dirty_start = self.pixel_count
+            self.dirty_stop = 0
+        pixels.set_bytes(data, start)
+        return True
+
+    def close(self):
+        self.socket.close()
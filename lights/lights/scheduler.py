@@ -0,0 +1,126 @@
+# Frame scheduler for the light patterns
+# Copyright Notice
+#
+# Patterns are generators which update the pixel buffer and then yield the
+# number of seconds the resulting frame should be displayed for.  The
+# scheduler pushes each frame and waits for an absolute deadline on the
+# monotonic clock, so the time spent rendering and writing to SPI is taken
+# out of the wait instead of being added on top of it.
+
+import logging
+import time
+
+import metrics
+
+class FrameStats(object):
+    """Frame counters for a scheduler run"""
+
+    def __init__(self, name=''):
+        self.name = name
+        # frames pushed to the lights
+        self.frames = 0
+        # frames which were pushed after their deadline had passed
+        self.late = 0
+        # frames which were not pushed at all because they were already over
+        self.skipped = 0
+        # frames which were identical to the one already on the lights
+        self.unchanged = 0
+        # total of the yielded frame durations
+        self.scheduled = 0.0
+        self.started = time.monotonic()
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def achieved_fps(self):
+        """Frames pushed per second since the run started"""
+        elapsed = self.elapsed()
+        return self.frames / elapsed if elapsed > 0 else 0.0
+
+    def target_fps(self):
+        """Frames per second the pattern asked for"""
+        total = self.frames + self.skipped
+        return total / self.scheduled if self.scheduled > 0 else 0.0
+
+    def __str__(self):
+        return '%s: %.1f fps (target %.1f), %d frames, %d late, %d skipped, %d unchanged' % (
+            self.name, self.achieved_fps(), self.target_fps(), self.frames, self.late, self.skipped, self.unchanged)
+
+
+class FrameScheduler(object):
+    """Runs a pattern generator against absolute frame deadlines"""
+
+    # frames pushed more than this many seconds after their deadline are counted as late
+    LATE_TOLERANCE = 0.002
+
+    # when the schedule falls further behind than this it is reset to the current
+    # time rather than trying to catch up
+    MAX_LAG = 0.25
+
+    # the maximum number of frames in a row that can be skipped, so that a
+    # pattern which is always behind still shows progress
+    MAX_SKIP = 4
+
+    # how often (in seconds) the frame rate is written to the log
+    REPORT_INTERVAL = 30
+
+    def __init__(self, show, clock=time.monotonic, sleep=time.sleep):
+        """show is called to push the current frame to the lights, it may
+           return False to designate that the frame was unchanged and not written
+        """
+        self.show = show
+        self.clock = clock
+        self.sleep = sleep
+        self.stats = FrameStats()
+        self.running = False
+
+    def stop(self):
+        """Stop the current run at the next frame boundary"""
+        self.running = False
+
+    def run(self, steps, name=''):
+        """Run the steps generator until it finishes or stop() is called"""
+        self.stats = stats = FrameStats(name)
+        self.running = True
+        deadline = self.clock()
+        next_report = deadline + self.REPORT_INTERVAL
+        skipped = 0
+        resumed = deadline
+        for wait in steps:
+            wait = max(0.0, wait or 0.0)
+            stats.scheduled += wait
+            now = self.clock()
+            metrics.render_seconds.observe(now - resumed)
+            late = now - deadline
+            # the frame was due at deadline and would have been replaced at
+            # deadline + wait, if that has already passed don't bother showing it
+            if wait > 0 and late >= wait and skipped < self.MAX_SKIP:
+                stats.skipped += 1
+                metrics.frames_skipped.inc()
+                skipped += 1
+            else:
+                if self.show() is False:
+                    stats.unchanged += 1
+                    metrics.frames_unchanged.inc()
+                else:
+                    metrics.frames_pushed.inc()
+                stats.frames += 1
+                skipped = 0
+                if late > self.LATE_TOLERANCE:
+                    stats.late += 1
+                    metrics.frames_late.inc()
+            deadline += wait
+            now = self.clock()
+            if now - deadline > self.MAX_LAG:
+                deadline = now
+            # sleep is always called (even with nothing left to wait for) so that
+            # a replacement sleep can use it to check for work between frames
+            self.sleep(max(0.0, deadline - now))
+            if now >= next_report:
+                logging.debug('%s', stats)
+                next_report = now + self.REPORT_INTERVAL
+            if not self.running:
+                break
+            resumed = self.clock()
+        logging.debug('%s', stats)
+        return stats
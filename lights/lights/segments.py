@@ -0,0 +1,81 @@
+# Output split across several SPI devices
+# Copyright Notice
+#
+# A long installation can be wired as several strips, each on its own SPI
+# port/device.  SegmentedOutput stands in for the single SPI device given to
+# WS2801Pixels, so the patterns still see one logical strip, and writes the
+# range of pixels belonging to each segment to its device.  The segments are
+# written concurrently (the SPI transfers release the GIL) so the frame time is
+# that of the longest segment rather than of the whole strip.
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+class Segment(object):
+    """Pixels start (inclusive) to stop (exclusive) of the logical strip, written
+       to device.  A reversed segment is wired with its first pixel at stop.
+    """
+
+    def __init__(self, start, stop, device, reversed=False):
+        if start < 0 or stop <= start:
+            raise ValueError('Invalid segment %d to %d' % (start, stop))
+        self.start = start
+        self.stop = stop
+        self.device = device
+        self.reversed = reversed
+        self.frame = bytearray((stop - start) * 3)
+        # prefer spidev's writebytes2 as WS2801Pixels does
+        self.write_bytes = device.write
+        spidev = getattr(device, '_device', None)
+        if spidev is not None and hasattr(spidev, 'writebytes2'):
+            self.write_bytes = spidev.writebytes2
+
+    def write(self, data):
+        """Write this segment's part of the frame data"""
+        data = memoryview(data)[self.start * 3:self.stop * 3]
+        if self.reversed:
+            # reverse the order of the pixels, keeping the channels of each in order
+            for channel in range(3):
+                self.frame[channel::3] = data[channel - 3::-3]
+            data = self.frame
+        self.write_bytes(data)
+
+
+class SegmentedOutput(object):
+    """SPI device which writes a frame across several segments at once"""
+
+    def __init__(self, segments):
+        self.segments = sorted(segments, key=lambda segment: segment.start)
+        for previous, segment in zip(self.segments, self.segments[1:]):
+            if segment.start < previous.stop:
+                raise ValueError('Segments %d to %d and %d to %d overlap' % (
+                    previous.start, previous.stop, segment.start, segment.stop))
+        self.executor = None
+        self.pid = None
+
+    def set_clock_hz(self, hz):
+        for segment in self.segments:
+            segment.device.set_clock_hz(hz)
+
+    def set_mode(self, mode):
+        for segment in self.segments:
+            segment.device.set_mode(mode)
+
+    def set_bit_order(self, order):
+        for segment in self.segments:
+            segment.device.set_bit_order(order)
+
+    def write(self, data):
+        """Write the frame to all segments, returning once every one has been written"""
+        if len(self.segments) == 1:
+            self.segments[0].write(data)
+            return
+        if self.pid != os.getpid():
+            # threads don't survive a fork, so each process has its own pool
+            self.executor = ThreadPoolExecutor(max_workers=len(self.segments) - 1)
+            self.pid = os.getpid()
+        futures = [self.executor.submit(segment.write, data) for segment in self.segments[1:]]
+        # the first segment is written from this thread
+        self.segments[0].write(data)
+        for future in futures:
+            future.result()
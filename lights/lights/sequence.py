@@ -0,0 +1,179 @@
+# Recorded frame sequences
+# Copyright Notice
+#
+# A sequence file is a fixed size header followed by fixed size frame records,
+# so a frame can be found from its index and the file can be played straight
+# from a memory map without loading it.
+#
+#   header: magic 'LSEQ', version (uint16), header size (uint16),
+#           pixel count (uint32), channel order (4 bytes, e.g. 'RGB'),
+#           frame count (uint32)
+#   frame:  duration in microseconds (uint32), pixel count * 3 bytes
+#
+# All numbers are little endian.
+
+import mmap
+import struct
+import time
+
+MAGIC = b'LSEQ'
+VERSION = 1
+HEADER = struct.Struct('<4sHHI4sI')
+DURATION = struct.Struct('<I')
+
+class SequenceWriter(object):
+    """Writes frames to a sequence file"""
+
+    def __init__(self, path, pixel_count, order='RGB'):
+        self.pixel_count = pixel_count
+        self.order = order
+        self.frames = 0
+        self.file = open(path, 'wb')
+        self.write_header()
+
+    def write_header(self):
+        self.file.write(HEADER.pack(MAGIC, VERSION, HEADER.size, self.pixel_count,
+                                    self.order.encode('ascii'), self.frames))
+
+    def write_frame(self, frame, duration):
+        """Write a frame of pixel_count * 3 bytes to be displayed for duration seconds"""
+        if len(frame) != self.pixel_count * 3:
+            raise ValueError('Frame must be %d bytes' % (self.pixel_count * 3))
+        self.file.write(DURATION.pack(max(0, int(round(duration * 1000000)))))
+        self.file.write(frame)
+        self.frames += 1
+
+    def close(self):
+        """Update the frame count in the header and close the file"""
+        self.file.seek(0)
+        self.write_header()
+        self.file.close()
+
+
+class SequenceReader(object):
+    """Reads frames from a memory mapped sequence file"""
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        try:
+            self.memory = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # an empty file can't be mapped
+            self.file.close()
+            raise ValueError('Not a sequence file: %s' % path)
+        magic, version, header_size, self.pixel_count, order, frames = HEADER.unpack_from(self.memory)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError('Not a sequence file: %s' % path)
+        self.order = order.rstrip(b'\0').decode('ascii')
+        self.offset = header_size
+        self.record_size = DURATION.size + self.pixel_count * 3
+        # use the size of the file in case the recording was not closed properly
+        available = (len(self.memory) - header_size) // self.record_size
+        self.frames = min(frames, available) if frames else available
+        self.view = memoryview(self.memory)
+
+    def __len__(self):
+        return self.frames
+
+    def frame(self, index):
+        """Returns (frame, duration) for the frame at index, the frame is a
+           memoryview into the file
+        """
+        start = self.offset + index * self.record_size
+        duration = DURATION.unpack_from(self.memory, start)[0] / 1000000.0
+        start += DURATION.size
+        return self.view[start:start + self.pixel_count * 3], duration
+
+    def __iter__(self):
+        for i in range(self.frames):
+            yield self.frame(i)
+
+    def close(self):
+        if getattr(self, 'view', None) is not None:
+            self.view.release()
+        self.memory.close()
+        self.file.close()
+
+
+class Recorder(object):
+    """Records every frame pushed by a WS2801Pixels object by wrapping its show()
+       The duration of each frame is the time until the next one is pushed and
+       consecutive identical frames are merged.
+    """
+
+    def __init__(self, pixels, path, order='RGB'):
+        self.pixels = pixels
+        self.writer = SequenceWriter(path, pixels.count(), order)
+        self.frame = None
+        self.time = None
+        self.show = pixels.show
+        pixels.show = self.record
+
+    def record(self, force=False):
+        frame = self.pixels.get_bytes()
+        if frame != self.frame:
+            now = time.monotonic()
+            if self.frame is not None:
+                self.writer.write_frame(self.frame, now - self.time)
+            self.frame = frame
+            self.time = now
+        return self.show(force)
+
+    def close(self):
+        """Write the last frame, stop recording and close the file"""
+        if self.frame is not None:
+            self.writer.write_frame(self.frame, time.monotonic() - self.time)
+        del self.pixels.show
+        self.writer.close()
+
+
+def record_steps(steps, pixels, path, order='RGB'):
+    """Render a pattern generator offline into a sequence file, using the
+       yielded waits as the frame durations rather than the time taken
+    """
+    writer = SequenceWriter(path, pixels.count(), order)
+    try:
+        for wait in steps:
+            writer.write_frame(pixels.get_bytes(), wait)
+    finally:
+        writer.close()
+    return writer.frames
+
+def play(pixels, path, rounds=0, order='RGB'):
+    """Generator which plays a sequence file, for running with the frame scheduler
+       Frames are converted if the sequence was recorded with a different
+       channel order or pixel count.
+    """
+    reader = SequenceReader(path)
+    data = None
+    try:
+        count = min(reader.pixel_count, pixels.count()) * 3
+        # mapping from the recorded channel order to the order of the strip
+        swap = [reader.order.index(c) for c in order] if sorted(reader.order) == sorted(order) else [0, 1, 2]
+        convert = swap != [0, 1, 2]
+        frame = bytearray(count)
+        if count < pixels.count() * 3:
+            # the sequence doesn't cover the whole strip
+            pixels.clear()
+        done = False
+        current_round = rounds
+        while not done:
+            for data, duration in reader:
+                if convert:
+                    for i in range(3):
+                        frame[i::3] = data[swap[i]:count:3]
+                    pixels.set_bytes(frame)
+                else:
+                    pixels.set_bytes(data[:count])
+                yield duration
+            if rounds > 0:
+                current_round -= 1
+                if current_round <= 0:
+                    done = True
+            if not len(reader):
+                break
+    finally:
+        # the last frame still references the memory map
+        data = None
+        reader.close()
@@ -0,0 +1,77 @@
+# Shared memory between the web process and the render worker
+# Copyright Notice
+#
+# The block is an anonymous shared mapping created at setup, before the render
+# worker is forked, so both processes map the same memory: a small state
+# record followed by the framebuffer used by WS2801Pixels.  (The Docker images
+# run Python 3.7 which does not have multiprocessing.shared_memory, an
+# anonymous mmap inherited over fork gives the same result.)
+
+import ctypes
+import mmap
+
+class SharedState(ctypes.Structure):
+    """The state record at the start of the shared block"""
+    _fields_ = [
+        # current color, color_version is incremented on every change so the
+        # render worker can tell that it has to pick up a new color
+        ('r', ctypes.c_uint8),
+        ('g', ctypes.c_uint8),
+        ('b', ctypes.c_uint8),
+        ('color_version', ctypes.c_uint32),
+        # name of the running pattern (empty when idle) and its arguments
+        ('pattern', ctypes.c_char * 64),
+        ('delay', ctypes.c_double),
+        ('pause', ctypes.c_double),
+        ('rounds', ctypes.c_int32),
+        # number of frames pushed by the render worker
+        ('frame', ctypes.c_uint64),
+        # monotonic time the first frame of the resumed state was pushed, 0
+        # until then
+        ('first_frame_at', ctypes.c_double),
+    ]
+
+class SharedBlock(object):
+    """State record and framebuffer shared between processes"""
+
+    def __init__(self, pixel_count):
+        offset = ctypes.sizeof(SharedState)
+        self.memory = mmap.mmap(-1, offset + pixel_count * 3)
+        self.state = SharedState.from_buffer(self.memory)
+        # the raw RGB pixel data, used as the WS2801Pixels buffer
+        self.framebuffer = memoryview(self.memory)[offset:]
+
+    def set_color(self, color):
+        self.state.r = color['r']
+        self.state.g = color['g']
+        self.state.b = color['b']
+        self.state.color_version += 1
+
+    def get_color(self):
+        return {
+            'r': self.state.r,
+            'g': self.state.g,
+            'b': self.state.b
+        }
+
+    def set_pattern(self, pattern=None, delay=0.0, pause=0.0, rounds=0):
+        """Record the running pattern (None when idle)"""
+        self.state.pattern = (pattern or '').encode('utf-8')[:63]
+        self.state.delay = delay
+        self.state.pause = pause
+        self.state.rounds = rounds
+
+    def get_state(self):
+        """Returns the state record as a dict"""
+        return {
+            'color': self.get_color(),
+            'pattern': self.state.pattern.decode('utf-8') or None,
+            'delay': self.state.delay,
+            'pause': self.state.pause,
+            'rounds': self.state.rounds,
+            'frame': self.state.frame,
+        }
+
+    def get_frame(self):
+        """Returns a copy of the current frame as RGB bytes"""
+        return bytes(self.framebuffer)
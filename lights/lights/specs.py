@@ -0,0 +1,315 @@
+# Declarative light patterns
+# Copyright Notice
+#
+# Patterns can be described in a JSON file (patterns.json, next to config.ini)
+# instead of being written in lights.py.  Each pattern is a list of steps which
+# are run in order every round, a step being one of the primitives:
+#
+#   {"fill": {"direction": "up", "color": "color", "off": false}}
+#       light (or with off, turn off) one more led every frame
+#   {"window": {"length": 10, "direction": "down", "color": [0, 0, 255]}}
+#       a window of leds moving along the strip one led every frame
+#   {"random": {"fraction": 0.5, "frames": 10, "color": "wheel"}}
+#       a different random subset of the leds every frame
+#   {"wheel": {"spread": true, "step": 1}}
+#       one cycle of the color wheel, either spread along the strip or with
+#       all leds the same color
+#   {"fade": {"to": "black", "frames": 50, "easing": "ease_in_out"}}
+#       fade from the current frame to black, the color or an [r, g, b] color
+#   {"off": {}}
+#       turn all leds off
+#   {"pause": null}
+#       hold the frame for the pattern's pause, or a number of seconds
+#
+# Colors are "color" (the current color, the default), "wheel" (a different
+# color on each frame) or [r, g, b].  Every step other than pause holds each of
+# its frames for the pattern's delay unless it has a "wait" in seconds.
+#
+# The steps are compiled once into the ranges or indexes of the leds to change
+# on each frame (when the specs are loaded, for the configured pixel count), so
+# running them only does slice assignments on the buffer.
+
+import json
+import random
+
+import fade
+import frames
+
+class SpecError(ValueError):
+    """Invalid pattern spec"""
+
+
+def load(path):
+    """Returns the pattern specs by name from the JSON file at path"""
+    with open(path) as f:
+        try:
+            specs = json.load(f)
+        except ValueError as e:
+            raise SpecError('Invalid JSON in %s: %s' % (path, e))
+    if not isinstance(specs, dict):
+        raise SpecError('%s must contain an object of patterns by name' % path)
+    return specs
+
+def compile_pattern(name, spec, controller):
+    """Compile a pattern spec into a pattern function which draws with the
+       controller (LightsController)
+    """
+    if not isinstance(spec, dict) or not isinstance(spec.get('steps'), list) or not spec['steps']:
+        raise SpecError('Pattern %s must have a list of steps' % name)
+    steps = [compile_step(name, step) for step in spec['steps']]
+    clear = bool(spec.get('clear', True))
+
+    def run(delay=0.1, pause=0.5, rounds=0):
+        if clear:
+            controller.pixels.clear()
+        done = False
+        current_round = rounds
+        while not done:
+            for step in steps:
+                yield from step.run(controller, delay, pause)
+            if rounds > 0:
+                current_round -= 1
+                if current_round <= 0:
+                    done = True
+
+    def prepare(count):
+        """Build the tables of the steps for count pixels"""
+        for step in steps:
+            step.table(count)
+
+    run.__name__ = name
+    run.prepare = prepare
+    # patterns without random steps give the same frames every round
+    run.deterministic = not any(isinstance(step, Random) for step in steps)
+    return run
+
+def compile_step(name, step):
+    if not isinstance(step, dict) or len(step) != 1:
+        raise SpecError('Each step of %s must be an object with one primitive' % name)
+    primitive, options = next(iter(step.items()))
+    if primitive == 'pause':
+        return Pause(options)
+    if primitive not in PRIMITIVES:
+        raise SpecError('Unknown primitive %s in %s' % (primitive, name))
+    if options is None:
+        options = {}
+    if not isinstance(options, dict):
+        raise SpecError('The options of %s in %s must be an object' % (primitive, name))
+    try:
+        return PRIMITIVES[primitive](options)
+    except (TypeError, ValueError, KeyError) as e:
+        raise SpecError('Invalid %s in %s: %s' % (primitive, name, e))
+
+def parse_color(value):
+    if value in ('color', 'wheel'):
+        return value
+    if isinstance(value, list) and len(value) == 3 and all(isinstance(v, int) and 0 <= v <= 255 for v in value):
+        return tuple(value)
+    raise ValueError('invalid color %r' % (value,))
+
+
+class Step(object):
+    """A compiled step, the tables for each pixel count are built by prepare()
+       or on first use.  Subclasses implement run(controller, delay, pause)
+       which draws the step's frames and yields their waits.
+    """
+
+    def __init__(self, options):
+        self.wait = options.get('wait')
+        if self.wait is not None:
+            self.wait = float(self.wait)
+        self.color = parse_color(options.get('color', 'color'))
+        self.tables = {}
+
+    def table(self, count):
+        table = self.tables.get(count)
+        if table is None:
+            table = self.tables[count] = self.build(count)
+        return table
+
+    def build(self, count):
+        return None
+
+    def colors(self, controller):
+        """Generator of the (r, g, b) color for each frame"""
+        if self.color == 'wheel':
+            position = 0
+            while True:
+                yield tuple(controller.wheel_rgb(position))
+                position += 7
+        elif self.color == 'color':
+            while True:
+                yield controller.rgb()
+        else:
+            while True:
+                yield self.color
+
+
+class Pause(Step):
+
+    def __init__(self, seconds):
+        if seconds is not None and not isinstance(seconds, (int, float)):
+            raise SpecError('A pause must be a number of seconds or null')
+        self.seconds = seconds
+        self.tables = {}
+
+    def run(self, controller, delay, pause):
+        yield pause if self.seconds is None else self.seconds
+
+
+class Fill(Step):
+
+    def __init__(self, options):
+        super(Fill, self).__init__(options)
+        self.direction = options.get('direction', 'up')
+        if self.direction not in ('up', 'down'):
+            raise ValueError('direction must be up or down')
+        self.off = bool(options.get('off', False))
+
+    def build(self, count):
+        if self.direction == 'up':
+            return list(range(count))
+        return list(range(count - 1, -1, -1))
+
+    def run(self, controller, delay, pause):
+        wait = delay if self.wait is None else self.wait
+        colors = self.colors(controller)
+        for i in self.table(controller.pixels.count()):
+            r, g, b = (0, 0, 0) if self.off else next(colors)
+            controller.pixels.fill_range(i, i + 1, r, g, b)
+            yield wait
+
+
+class Window(Step):
+
+    def __init__(self, options):
+        super(Window, self).__init__(options)
+        self.length = int(options.get('length', 1))
+        if self.length < 1:
+            raise ValueError('length must be at least 1')
+        self.direction = options.get('direction', 'up')
+        if self.direction not in ('up', 'down'):
+            raise ValueError('direction must be up or down')
+
+    def build(self, count):
+        # the lit range [start, stop) for each frame as the window moves in from
+        # one end and out of the other
+        ranges = []
+        for head in range(count + self.length - 1):
+            start, stop = max(head - self.length + 1, 0), min(head + 1, count)
+            if self.direction == 'down':
+                start, stop = count - stop, count - start
+            ranges.append((start, stop))
+        return ranges
+
+    def run(self, controller, delay, pause):
+        wait = delay if self.wait is None else self.wait
+        colors = self.colors(controller)
+        pixels = controller.pixels
+        count = pixels.count()
+        for start, stop in self.table(count):
+            r, g, b = next(colors)
+            pixels.fill_range(0, start, 0, 0, 0)
+            pixels.fill_range(start, stop, r, g, b)
+            pixels.fill_range(stop, count, 0, 0, 0)
+            yield wait
+        pixels.fill_range(0, count, 0, 0, 0)
+
+
+class Random(Step):
+
+    def __init__(self, options):
+        super(Random, self).__init__(options)
+        self.fraction = float(options.get('fraction', 0.5))
+        if not 0 <= self.fraction <= 1:
+            raise ValueError('fraction must be 0 to 1')
+        self.frames = int(options.get('frames', 1))
+
+    def build(self, count):
+        return list(range(count)), int(round(count * self.fraction))
+
+    def run(self, controller, delay, pause):
+        wait = delay if self.wait is None else self.wait
+        colors = self.colors(controller)
+        pixels = controller.pixels
+        lights, size = self.table(pixels.count())
+        for j in range(self.frames):
+            lit = random.sample(lights, size)
+            r, g, b = next(colors)
+            if frames.enabled:
+                frame = frames.as_frame(pixels.buffer())
+                frame[:] = 0
+                frame[lit] = (r, g, b)
+            else:
+                pixels.clear()
+                for i in lit:
+                    pixels.set_pixel_rgb(i, r, g, b)
+            yield wait
+
+
+class Wheel(Step):
+
+    def __init__(self, options):
+        super(Wheel, self).__init__(options)
+        self.spread = bool(options.get('spread', True))
+        self.step = int(options.get('step', 1))
+        if not 1 <= self.step <= 255:
+            raise ValueError('step must be 1 to 255')
+
+    def run(self, controller, delay, pause):
+        wait = delay if self.wait is None else self.wait
+        for j in range(0, 256, self.step):
+            if self.spread:
+                controller.set_wheel_frame(j)
+            else:
+                controller.set_wheel_color(j)
+            yield wait
+
+
+class Fade(Step):
+
+    def __init__(self, options):
+        super(Fade, self).__init__(options)
+        self.to = options.get('to', 'black')
+        if self.to != 'black':
+            self.to = parse_color(self.to)
+            if self.to == 'wheel':
+                raise ValueError('can not fade to the wheel')
+        self.frames = int(options.get('frames', 50))
+        if self.frames < 1:
+            raise ValueError('frames must be at least 1')
+        ease = fade.easings[options.get('easing', 'linear')]
+        # the blend amount of each frame
+        self.amounts = [ease((j + 1) / self.frames) for j in range(self.frames)]
+
+    def run(self, controller, delay, pause):
+        wait = delay if self.wait is None else self.wait
+        pixels = controller.pixels
+        count = pixels.count()
+        if self.to == 'black':
+            target = bytes(count * 3)
+        elif self.to == 'color':
+            target = bytes(controller.rgb()) * count
+        else:
+            target = bytes(self.to) * count
+        start = pixels.get_bytes()
+        for amount in self.amounts:
+            fade.blend(pixels, start, target, amount)
+            yield wait
+
+
+class Off(Step):
+
+    def run(self, controller, delay, pause):
+        controller.pixels.clear()
+        yield delay if self.wait is None else self.wait
+
+
+PRIMITIVES = {
+    'fill': Fill,
+    'window': Window,
+    'random': Random,
+    'wheel': Wheel,
+    'fade': Fade,
+    'off': Off,
+    }
@@ -0,0 +1,115 @@
+# Persisted state of the lights
+# Copyright Notice
+#
+# The last color, brightness and running pattern are kept in a small JSON
+# file so that they can be resumed straight away when the app restarts.
+#
+# Both the web process and the render worker change the file (the worker
+# removes a pattern which has finished by itself), so every change re-reads
+# the file under an exclusive lock and then replaces it atomically.  The last
+# state read or written is kept along with the file's inode and modification
+# time, a change to values which are already saved is skipped without taking
+# the lock as long as the file hasn't been replaced since.
+
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import threading
+
+class StateFile(object):
+    """JSON state file which is replaced atomically on every save"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        # the last state read or written and the stamp of the file it was in
+        self.saved = None
+        self.stamp = None
+
+    def load(self):
+        """Returns the saved state, an empty dict if there is none or it can't be read"""
+        stamp = self.get_stamp()
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            state = {}
+        except (OSError, ValueError):
+            logging.exception('Could not read the state file %s', self.path)
+            state = {}
+        if not isinstance(state, dict):
+            state = {}
+        self.remember(state, stamp)
+        return state
+
+    def update(self, **values):
+        """Change the given values and save the state, nothing is written if
+           they are unchanged
+        """
+        if self.saved is not None and self.stamp is not None and self.stamp == self.get_stamp() \
+                and all(self.saved.get(key) == value for key, value in values.items()):
+            return
+        with self.locked():
+            state = self.load()
+            if all(state.get(key) == value for key, value in values.items()):
+                return
+            state.update(values)
+            self.save(state)
+
+    def remove(self, key, match=None):
+        """Remove the key from the saved state, if match is given only when
+           match(value) returns True for the saved value
+        """
+        with self.locked():
+            state = self.load()
+            if key not in state or (match is not None and not match(state[key])):
+                return
+            del state[key]
+            self.save(state)
+
+    @contextlib.contextmanager
+    def locked(self):
+        """Hold the lock on the state file, across threads and processes"""
+        with self.lock:
+            lock_file = None
+            try:
+                directory = os.path.dirname(self.path)
+                if not os.path.exists(directory):
+                    os.makedirs(directory)
+                lock_file = open(self.path + '.lock', 'a')
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            except OSError:
+                logging.exception('Could not lock the state file %s', self.path)
+            try:
+                yield
+            finally:
+                if lock_file is not None:
+                    lock_file.close()
+
+    def save(self, state):
+        try:
+            temp = self.path + '.tmp'
+            with open(temp, 'w') as f:
+                json.dump(state, f)
+            os.replace(temp, self.path)
+        except OSError:
+            logging.exception('Could not write the state file %s', self.path)
+            self.remember(None, None)
+            return
+        self.remember(state, self.get_stamp())
+
+    def get_stamp(self):
+        """Returns the inode, modification time and size of the file, None if
+           it doesn't exist
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def remember(self, state, stamp):
+        self.saved = json.loads(json.dumps(state)) if state is not None else None
+        self.stamp = stamp
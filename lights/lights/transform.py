@@ -0,0 +1,44 @@
+# Output transform for the lights
+# Copyright Notice
+#
+# The pixel buffer always holds plain RGB.  When a frame is pushed it is passed
+# through one output stage which reorders the channels for the strip (e.g. RBG)
+# and maps each channel through a 256 entry lookup table combining gamma
+# correction and the global brightness.  Changing the brightness only rebuilds
+# the tables.
+
+class OutputTransform(object):
+    """Maps an RGB frame to the bytes written to the strip"""
+
+    def __init__(self, order='RGB', gamma=1.0, brightness=255):
+        """order is the channel order of the strip, gamma is either one value or
+           an (r, g, b) tuple and brightness is 0 to 255
+        """
+        if sorted(order) != ['B', 'G', 'R']:
+            raise ValueError('Invalid channel order: %s' % order)
+        if not isinstance(gamma, (tuple, list)):
+            gamma = (gamma, gamma, gamma)
+        self.order = order
+        self.gamma = tuple(gamma)
+        self.brightness = min(max(int(brightness), 0), 255)
+        tables = [self.table(value, self.brightness) for value in self.gamma]
+        # the input channel and table for each output channel
+        self.channels = [('RGB'.index(c), tables['RGB'.index(c)]) for c in order]
+        self.identity = order == 'RGB' and self.gamma == (1.0, 1.0, 1.0) and self.brightness == 255
+        self.out = bytearray()
+
+    @staticmethod
+    def table(gamma, brightness):
+        """The 256 entry lookup table for the gamma and brightness"""
+        level = brightness / 255.0
+        return bytes(int(round((i / 255.0) ** gamma * level * 255)) for i in range(256))
+
+    def __call__(self, frame):
+        """Returns the transformed frame, the result is reused by the next call"""
+        if self.identity:
+            return frame
+        if len(self.out) != len(frame):
+            self.out = bytearray(len(frame))
+        for i, (channel, table) in enumerate(self.channels):
+            self.out[i::3] = bytes(frame[channel::3]).translate(table)
+        return self.out
@@ -0,0 +1,53 @@
+# Virtual output devices for the lights
+# Copyright Notice
+#
+# These take the place of the hardware SPI device given to WS2801Pixels so the
+# real patterns can run where there is no LED strip (e.g. on an x86 machine).
+
+import collections
+import time
+
+class NullSpi(object):
+    """SPI device which discards the data, counting the bytes written"""
+
+    def __init__(self):
+        self.writes = 0
+        self.bytes = 0
+
+    def set_clock_hz(self, hz):
+        pass
+
+    def set_mode(self, mode):
+        pass
+
+    def set_bit_order(self, order):
+        pass
+
+    def write(self, data):
+        self.writes += 1
+        self.bytes += len(data)
+
+
+class VirtualStrip(NullSpi):
+    """SPI device which records every frame written to it
+       The frames are kept as (monotonic timestamp, bytes) in a ring buffer
+       holding the most recent capacity frames.
+    """
+
+    def __init__(self, capacity=1000):
+        super(VirtualStrip, self).__init__()
+        self.frames = collections.deque(maxlen=capacity)
+
+    def write(self, data):
+        self.frames.append((time.monotonic(), bytes(data)))
+        self.writes += 1
+        self.bytes += len(data)
+
+    def last_frame(self):
+        """Returns the most recent frame or None if nothing has been written"""
+        if not self.frames:
+            return None
+        return self.frames[-1][1]
+
+    def clear(self):
+        self.frames.clear()
@@ -2,32 +2,70 @@
 # Phil Hansen, 22 October 2016
 # Copyright Notice
 
-from flask import Flask, g, render_template, request
+from flask import Flask, Response, abort, g, jsonify, render_template, request
+import os
+import time
+
+# when the app started loading, for the time to the first frame
+started = time.monotonic()
+
 import config
+import metrics
 
-try:
-    from lights import LightsController, patterns
-except RuntimeError:
-    # a RuntimeError occurs when the GPIO interface could not be loaded
-    # (e.g. if not running on a Raspberry Pi)
-    # in this case load the mock version of the controller
-    from lights_mock import LightsController, patterns
+# when the GPIO interface is not available (e.g. if not running on a Raspberry Pi)
+# the lights are written to a virtual strip, see the [output] section of config.ini
+from lights import LightsController, patterns
 
 # set key for sessions
 SECRET_KEY = 'HDRE%(@3278skdfdD34@^*'
 app = Flask(__name__, template_folder=config.path_templates, static_folder=config.path_web, static_url_path='/static')
 app.config.from_object(__name__)
 
+# set up the lights (and resume the saved state) when the app is loaded rather
+# than on the first request, uwsgi loads the app in the worker (lazy-apps).
+# When run directly with the reloader only the reloaded child sets them up.
+if __name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+    config.setup_logging()
+    LightsController.setup()
+    config.initialized = True
+
 @app.before_request
 def before_request():
+    g.started = time.perf_counter()
     g.title = config.title
     # format the RGB color value as the 6 character hex code
     g.color = get_color_in_hex()
-    # only need to do this once
-    if not config.initialized:
-        LightsController.setup()
-        config.initialized = True
+    g.brightness = config.brightness
     
+@app.after_request
+def after_request(response):
+    if metrics.enabled and 'started' in g:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.request_seconds.labels(route).observe(time.perf_counter() - g.started)
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Metrics for the render and SPI paths in the Prometheus text format"""
+    if not metrics.enabled:
+        abort(404)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/ready')
+def ready():
+    """Returns whether the lights are ready and the time (in seconds) from the
+       app starting to load to the first frame being pushed, as JSON
+    """
+    worker = LightsController.worker
+    is_ready = config.initialized and worker is not None and worker.is_alive()
+    first_frame = LightsController.shared.state.first_frame_at if LightsController.shared is not None else 0
+    data = {
+        'ready': is_ready,
+        'time_to_first_frame': first_frame - started if first_frame else None,
+        'pattern': LightsController.get_state()['pattern'] if is_ready else None,
+    }
+    return jsonify(data), 200 if is_ready else 503
+
 @app.route('/')
 def index():
     """Main page"""
@@ -45,7 +83,13 @@ def lights_on(id=None):
     if id is None:
         LightsController.on()
     else:
-        LightsController.on([int(id)])
+        try:
+            light = int(id)
+        except ValueError:
+            return 'Invalid light', 400
+        if not 0 <= light < config.pixel_count:
+            return 'Light must be from 0 to %d' % (config.pixel_count - 1), 400
+        LightsController.on([light])
     return ''
     
 @app.route('/lights/off', methods=['GET', 'POST'])
@@ -56,7 +100,13 @@ def lights_off(id=None):
     if id is None:
         LightsController.off()
     else:
-        LightsController.off([int(id)])
+        try:
+            light = int(id)
+        except ValueError:
+            return 'Invalid light', 400
+        if not 0 <= light < config.pixel_count:
+            return 'Light must be from 0 to %d' % (config.pixel_count - 1), 400
+        LightsController.off([light])
     return ''
 
 @app.route('/lights/color', methods=['GET', 'POST'])
@@ -68,54 +118,107 @@ def lights_color():
     try:
         data = request.get_json(force=True)
         if data is not None and 'r' in data:
-            config.color = data
-            LightsController.set_color()
+            LightsController.update_color(data)
     except Exception:
         pass
     return ''
 
+@app.route('/lights/brightness/<int:value>', methods=['GET', 'POST'])
+def lights_brightness(value):
+    """Set the global brightness of the lights (0 to 255)"""
+    LightsController.set_brightness(value)
+    return ''
+
 @app.route('/lights/random_color', methods=['GET', 'POST'])
 @app.route('/lights/random_color/', methods=['GET', 'POST'])
 def lights_random_color():
     """Set color of lights to a random color
        Returns the color value in hex in order to update the color picker
     """
-    config.color = LightsController.get_random_color()
-    LightsController.set_color()
+    LightsController.update_color(LightsController.get_random_color())
     return get_color_in_hex()
 
 def get_color_in_hex():
     """Returns the RGB color value formatted as a 6 character hex code"""
     return '#%02x%02x%02x' % (config.color['r'], config.color['g'], config.color['b'])
     
-@app.route('/lights/slide/bottom/<value>', methods=['GET', 'POST'])
+@app.route('/lights/state', methods=['GET'])
+def lights_state():
+    """Returns the current color, brightness, running pattern and frame count as JSON"""
+    return jsonify(LightsController.get_state())
+
+@app.route('/lights/frame', methods=['GET'])
+def lights_frame():
+    """Returns the frame currently on the lights as raw RGB bytes (3 per pixel)"""
+    return Response(LightsController.get_frame(), mimetype='application/octet-stream')
+
+@app.route('/lights/record/start/<name>', methods=['GET', 'POST'])
+def lights_record_start(name):
+    """Start recording the frames on the lights into the named sequence
+       The sequence can be played back with the pattern sequence:<name>
+    """
+    LightsController.start_recording(name)
+    return ''
+
+@app.route('/lights/record/stop', methods=['GET', 'POST'])
+def lights_record_stop():
+    """Stop recording frames"""
+    LightsController.stop_recording()
+    return ''
+
+@app.route('/lights/pixels', methods=['POST'])
+def lights_pixels():
+    """Set many lights in one request, the lights are only pushed once
+       The body is either raw RGB bytes (3 per pixel, application/octet-stream)
+       written from the light given by the start argument (default 0), or a
+       JSON list of [index, r, g, b] updates
+    """
+    if request.mimetype == 'application/json':
+        try:
+            updates = parse_pixel_updates(request.get_json(force=True))
+        except (TypeError, ValueError) as e:
+            return str(e), 400
+        LightsController.set_pixels(updates)
+    else:
+        data = request.get_data()
+        try:
+            start = int(request.args.get('start', 0))
+        except ValueError:
+            return 'Invalid start', 400
+        if len(data) % 3 != 0:
+            return 'Frame must be a multiple of 3 bytes', 400
+        if start < 0 or start + len(data) // 3 > config.pixel_count:
+            return 'Frame does not fit within %d lights' % config.pixel_count, 400
+        LightsController.set_frame(data, start)
+    return ''
+
+def parse_pixel_updates(data):
+    """Validates a JSON list of [index, r, g, b] and returns it as a list of tuples"""
+    if not isinstance(data, list):
+        raise TypeError('Expected a list of [index, r, g, b]')
+    updates = []
+    for update in data:
+        if not isinstance(update, list) or len(update) != 4 or \
+                not all(isinstance(v, int) and not isinstance(v, bool) for v in update):
+            raise TypeError('Invalid update: %r' % (update,))
+        i, r, g, b = update
+        if not 0 <= i < config.pixel_count:
+            raise ValueError('Light %d outside 0 to %d' % (i, config.pixel_count - 1))
+        if not (0 <= r <= 255 and 0 <= g <= 255 and 0 <= b <= 255):
+            raise ValueError('Invalid color for light %d' % i)
+        updates.append((i, r, g, b))
+    return updates
+
+@app.route('/lights/slide/bottom/<int(signed=True):value>', methods=['GET', 'POST'])
 def lights_bottom_to_top(value):
     """Turn all lights on up to value, from bottom to top"""
-    if value == '-1':
-        LightsController.off()
-    else:
-        lights = []
-        current = 0
-        while current <= int(value):
-            lights.append(current)
-            current += 1
-        LightsController.on(lights)
-        LightsController.off(list(set(range(0, config.pixel_count)) - set(lights)))
+    LightsController.show_range(0, value + 1)
     return ''
 
-@app.route('/lights/slide/top/<value>', methods=['GET', 'POST'])
+@app.route('/lights/slide/top/<int(signed=True):value>', methods=['GET', 'POST'])
 def lights_top_to_bottom(value):
     """Turn all lights on up to value, from top to bottom"""
-    if value == config.pixel_count:
-        LightsController.off()
-    else:
-        lights = []
-        current = config.pixel_count - 1
-        while current >= int(value):
-            lights.append(current)
-            current -= 1
-        LightsController.on(lights)
-        LightsController.off(list(set(range(0, config.pixel_count)) - set(lights)))
+    LightsController.show_range(value, config.pixel_count)
     return ''
 
 @app.route('/lights/pattern', methods=['GET', 'POST'])
@@ -128,7 +231,10 @@ def pattern():
     pattern = request.args.get('name')
     delay = float(request.args.get('delay', 0.1))
     pause = float(request.args.get('pause', 0.5))
-    LightsController.start_pattern(pattern=pattern, delay=delay, pause=pause)
+    try:
+        LightsController.start_pattern(pattern=pattern, delay=delay, pause=pause)
+    except ValueError as e:
+        return str(e), 400
     return ''
     
 if __name__ == '__main__':
@@ -0,0 +1,348 @@
+# Render worker for the light patterns
+# Copyright Notice
+#
+# A single long-lived process runs the patterns.  It is started once at setup
+# and takes commands over a queue, which are picked up between frames while
+# the frame scheduler is waiting for the next deadline.  Switching patterns is
+# therefore bounded by one frame and never interrupts an SPI transfer.
+#
+# The color and the state of the running pattern live in the shared block (see
+# shared.py) so they can be changed and read from the web process without
+# going through the queue.
+#
+# The worker is the only writer to the lights.  Changes made from the web
+# process are sent as lists of drawing operations (see apply), consecutive ones
+# are applied together and pushed as a single frame, so concurrent requests
+# never interleave on the wire.
+#
+# When the realtime input is enabled (see realtime.py) the frames received
+# over UDP take over the lights until the stream stops for the configured
+# timeout, then the previous pattern is resumed.
+#
+# The frames of the expensive patterns can be rendered ahead by the render
+# pool (see pool.py), the worker then only copies them in and pushes them.
+
+import logging
+import multiprocessing
+import queue
+import time
+
+import config
+import fade
+import metrics
+from realtime import RealtimeReceiver
+from scheduler import FrameScheduler
+from sequence import Recorder
+
+class RenderWorker(object):
+    """Runs the light patterns in a separate process"""
+
+    # how long (in seconds) to wait for the worker to acknowledge a stop
+    STOP_TIMEOUT = 1.0
+
+    def __init__(self, pixels, steps, shared, pool=None, finished=None):
+        """pixels is the WS2801Pixels object the frames are pushed to,
+           steps(pattern, delay, pause, rounds) must return the pattern generator
+           and shared is the SharedBlock holding the color and pattern state.
+           The patterns the pool (RenderPool) renders are run with it.
+           finished(pattern) is called in the worker process when a pattern
+           finishes by itself.
+        """
+        self.pixels = pixels
+        self.steps = steps
+        self.shared = shared
+        self.pool = pool
+        self.finished = finished
+        self.commands = multiprocessing.Queue()
+        # set whenever the worker is not running a pattern
+        self.idle = multiprocessing.Event()
+        self.idle.set()
+        self.process = None
+        # the following are only used inside the worker process
+        self.scheduler = None
+        self.current = None
+        self.pending = None
+        self.color_version = None
+        self.recorder = None
+        self.receiver = None
+
+    def start(self):
+        """Start the worker process"""
+        self.process = multiprocessing.Process(target=self.run, name='lights-render')
+        self.process.daemon = True
+        self.process.start()
+
+    def is_alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def send(self, *command):
+        """Queue a command for the worker"""
+        self.commands.put(command)
+
+    def start_pattern(self, pattern, delay, pause, rounds):
+        """Switch to the given pattern at the next frame boundary"""
+        # clear this right away so that a following stop_pattern waits for it
+        self.idle.clear()
+        self.send('start', pattern, delay, pause, rounds, time.monotonic())
+
+    def stop_pattern(self, wait=True):
+        """Stop the running pattern
+           Set wait to False to return without waiting for the worker to stop
+        """
+        if self.idle.is_set():
+            return
+        self.send('stop', time.monotonic())
+        if wait and not self.idle.wait(self.STOP_TIMEOUT):
+            logging.warning('Render worker did not stop the pattern within %s seconds', self.STOP_TIMEOUT)
+
+    def draw(self, ops, stop=True):
+        """Apply the drawing operations and push the result at the next frame
+           boundary, stopping the running pattern.  If stop is False the
+           operations are skipped while a pattern is running.
+        """
+        self.send('draw', ops, stop, time.monotonic())
+
+    @staticmethod
+    def apply(pixels, ops):
+        """Apply a list of drawing operations to pixels, each one of:
+             ('fill', start, stop, r, g, b)  fill the range of leds
+             ('pixels', [(index, r, g, b), ...])  set single leds
+             ('bytes', start, data)  copy packed bytes from led start
+        """
+        for op in ops:
+            name = op[0]
+            if name == 'fill':
+                pixels.fill_range(*op[1:])
+            elif name == 'pixels':
+                for i, r, g, b in op[1]:
+                    pixels.set_pixel_rgb(i, r, g, b)
+            elif name == 'bytes':
+                pixels.set_bytes(op[2], op[1])
+            else:
+                raise ValueError('Unknown drawing operation: %s' % name)
+
+    def set_color(self, color):
+        """Change the color used by the running pattern, it is picked up at the
+           next frame boundary
+        """
+        self.shared.set_color(color)
+
+    def set_transform(self, transform):
+        """Change the output transform (see transform.py) of the frames pushed,
+           the current frame is pushed again with it
+        """
+        self.send('transform', transform)
+
+    def record(self, path, order):
+        """Start recording the pushed frames into the sequence file at path
+           or stop recording if path is None
+        """
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+        if path is not None:
+            self.recorder = Recorder(self.pixels, path, order)
+
+    def run(self):
+        """Main loop of the worker process"""
+        self.scheduler = FrameScheduler(self.push, sleep=self.wait)
+        if self.pool is not None:
+            # the pool processes are forked before any threads are started
+            self.pool.start(self.pixels.count())
+        if config.realtime_enabled:
+            try:
+                self.receiver = RealtimeReceiver(self.pixels.count(), lambda: self.send('frame'),
+                                                 config.realtime_port, config.realtime_protocol,
+                                                 config.realtime_universe, config.realtime_address)
+                self.receiver.start()
+                logging.info('Receiving realtime frames on port %d', config.realtime_port)
+            except OSError:
+                logging.exception('Could not receive realtime frames on port %d, realtime input is disabled',
+                                  config.realtime_port)
+                self.receiver = None
+        while True:
+            command = self.pending
+            self.pending = None
+            if command is None:
+                command = self.commands.get()
+            self.sync_color()
+            try:
+                self.handle(command)
+            except Exception:
+                logging.exception('Error in render worker handling %s', command[0])
+
+    def handle(self, command):
+        """Handle a command while no pattern is running"""
+        name = command[0]
+        if name == 'start':
+            self.current = list(command[1:5])
+            if len(command) > 5:
+                # the time the command was sent, to measure the switch latency
+                metrics.switch_seconds.observe(time.monotonic() - command[5])
+            self.run_pattern()
+        elif name == 'stop':
+            self.current = None
+            self.shared.set_pattern()
+            self.stopped(command[1])
+        elif name == 'record':
+            self.record(*command[1:])
+        elif name == 'frame':
+            self.run_realtime()
+        elif name == 'transform':
+            self.pixels.set_transform(command[1])
+            self.push()
+        elif name == 'draw':
+            self.current = None
+            self.shared.set_pattern()
+            self.run_draw(command)
+            self.stopped(command[3])
+
+    def stopped(self, sent):
+        """Mark the worker as idle after a stop or draw command, sent is the
+           time the command was sent
+        """
+        self.idle.set()
+        metrics.stop_seconds.observe(time.monotonic() - sent)
+
+    def run_draw(self, command):
+        """Apply a draw command along with any others queued right behind it,
+           then push the result once
+        """
+        while True:
+            try:
+                self.apply(self.pixels, command[1])
+            except Exception:
+                # the other drawings are still applied and pushed
+                logging.exception('Error applying drawing operations')
+            try:
+                command = self.commands.get_nowait()
+            except queue.Empty:
+                break
+            if command[0] != 'draw':
+                self.pending = command
+                break
+        self.push()
+
+    def run_pattern(self):
+        """Run the current pattern until it finishes or another command replaces it"""
+        pattern, delay, pause, rounds = self.current
+        self.idle.clear()
+        self.shared.set_pattern(pattern, delay, pause, rounds)
+        steps = None
+        try:
+            if self.pool is not None and self.pool.renders(pattern):
+                steps = self.pool.run(self.pixels, pattern, delay, pause, rounds)
+            else:
+                steps = self.steps(pattern, delay, pause, rounds)
+            previous = self.pixels.get_bytes()
+            if config.crossfade > 0 and any(previous):
+                steps = fade.crossfade(self.pixels, previous, steps, config.crossfade, config.fade_easing)
+            self.scheduler.run(steps, name=pattern)
+        except Exception:
+            logging.exception('Error in pattern %s', pattern)
+        if steps is not None:
+            steps.close()
+        if self.pool is not None:
+            self.pool.stop()
+        if self.pending is None:
+            # the pattern finished by itself
+            self.current = None
+            self.shared.set_pattern()
+            self.idle.set()
+            if self.finished is not None:
+                self.finished(pattern)
+
+    def run_realtime(self):
+        """Push the frames from the realtime input until none arrive within the
+           timeout, then resume the pattern which was running (or restore the
+           previous frame).  Pattern commands received in the meantime change
+           what is resumed.
+        """
+        previous = None if self.current else self.pixels.get_bytes()
+        self.shared.set_pattern('realtime')
+        logging.info('Realtime input started')
+        if self.receiver.apply(self.pixels):
+            self.push()
+        while True:
+            # a command may have been picked up behind a drawing
+            command = self.pending
+            self.pending = None
+            if command is None:
+                try:
+                    command = self.commands.get(timeout=config.realtime_timeout)
+                except queue.Empty:
+                    break
+            name = command[0]
+            if name == 'frame':
+                if self.receiver.apply(self.pixels):
+                    self.push()
+            elif name == 'start':
+                self.current = list(command[1:5])
+                previous = None
+            elif name == 'stop':
+                self.current = None
+                previous = None
+                self.stopped(command[1])
+            elif name == 'record':
+                self.record(*command[1:])
+            elif name == 'transform':
+                self.pixels.set_transform(command[1])
+                self.push()
+            elif name == 'draw' and command[2]:
+                self.current = None
+                previous = None
+                self.run_draw(command)
+                self.stopped(command[3])
+        logging.info('Realtime input timed out')
+        if self.current is not None:
+            self.pending = ('start',) + tuple(self.current)
+            return
+        if previous is not None:
+            self.pixels.set_bytes(previous)
+            self.push()
+        self.shared.set_pattern()
+
+    def push(self):
+        """Push the current frame and count it in the shared state"""
+        started = time.perf_counter()
+        shown = self.pixels.show()
+        if shown is not False:
+            metrics.show_seconds.observe(time.perf_counter() - started)
+            metrics.bytes_written.inc(self.pixels.count() * 3)
+        self.shared.state.frame += 1
+        if not self.shared.state.first_frame_at:
+            self.shared.state.first_frame_at = time.monotonic()
+        return shown
+
+    def sync_color(self):
+        """Pick up a color change made through the shared state"""
+        version = self.shared.state.color_version
+        if version != self.color_version:
+            self.color_version = version
+            config.color = self.shared.get_color()
+
+    def wait(self, timeout):
+        """Wait for the next frame deadline, handling any commands which arrive
+           in the meantime.  This replaces the scheduler's sleep.
+        """
+        self.sync_color()
+        end = time.monotonic() + timeout
+        while True:
+            try:
+                command = self.commands.get(timeout=max(0.0, end - time.monotonic()))
+            except queue.Empty:
+                return
+            name = command[0]
+            if name == 'record':
+                self.record(*command[1:])
+                continue
+            if name == 'transform':
+                # used from the pattern's next frame
+                self.pixels.set_transform(command[1])
+                continue
+            if name == 'draw' and not command[2]:
+                # the running pattern takes precedence
+                continue
+            self.pending = command
+            self.scheduler.stop()
+            return
@@ -77,6 +77,27 @@ $(document).ready(function() {
         },
     });
     
+    brightness_last_value = -1;
+    $("#brightness").rangeslider({
+        'update': true,
+        'polyfill': false,
+        onSlide: function(position, value) {
+            if (brightness_last_value != value) {
+                brightness_last_value = value;
+                $.ajax({
+                    type: 'POST',
+                    url: url + 'brightness/' + value,
+                    data: {},
+                    dataType: 'html',
+                    cache: false,
+                    success: function(html) {
+                        console.log('brightness: success');
+                    }
+                });
+            }
+        },
+    });
+    
     $("#off").on("click", function(e) {
         $.ajax({
             type: 'POST',